@@ -0,0 +1,310 @@
+import argparse
+import json
+import os
+
+from qgis.core import QgsApplication, QgsDataProvider, QgsProject, QgsVectorLayer
+
+from instrumentation import log, run_report, stage
+
+
+class BatchSession:
+    # One standalone QGIS application and project for a whole batch of jobs.
+    # Layers are looked up by name in the open project; every layer a stage
+    # creates is written to the output GeoPackage and added to the project,
+    # so later stages of the same job can use it.
+
+    def __init__(self):
+        self.application = QgsApplication.instance()
+        self.owns_application = self.application is None
+        if self.owns_application:
+            self.application = QgsApplication([], False)
+            self.application.initQgis()
+        self.project = QgsProject.instance()
+        self.output = None
+        self.drawing_context = None
+
+    def close(self):
+        if self.owns_application:
+            self.application.exitQgis()
+
+    def open(self, path, output=None):
+        # A .qgz/.qgs project, or a GeoPackage whose tables are all loaded as layers
+        self.project.clear()
+        self.drawing_context = None
+        if os.path.splitext(path)[1].lower() in ('.qgz', '.qgs'):
+            if not self.project.read(path):
+                raise RuntimeError(
+                    f'Could not open {path}: {self.project.error()}')
+        else:
+            probe = QgsVectorLayer(path, 'probe', 'ogr')
+            if not probe.isValid():
+                raise RuntimeError(f'Could not open {path}')
+            for sublayer in probe.dataProvider().subLayers():
+                layer_name = sublayer.split(QgsDataProvider.sublayerSeparator())[1]
+                self.project.addMapLayer(QgsVectorLayer(
+                    f'{path}|layername={layer_name}', layer_name, 'ogr'))
+        base = os.path.dirname(os.path.abspath(path))
+        self.output = os.path.join(base, output) if output else \
+            os.path.splitext(os.path.abspath(path))[0] + '_results.gpkg'
+
+    def layer(self, layer_name):
+        layers = self.project.mapLayersByName(layer_name)
+        if not layers:
+            raise ValueError(f'Layer {layer_name} not found')
+        return layers[0]
+
+    def output_path(self, path):
+        return os.path.join(os.path.dirname(self.output), path)
+
+    def use(self, layer):
+        # Add a layer to the project in place of any layer with the same name
+        for existing in self.project.mapLayersByName(layer.name()):
+            self.project.removeMapLayer(existing.id())
+        self.project.addMapLayer(layer)
+        return layer
+
+    def keep(self, layer):
+        # Write a result layer to the output GeoPackage and use the saved copy
+        from structure_counts import save_to_geopackage
+
+        return self.use(save_to_geopackage(layer, self.output))
+
+
+def draw_network_stage(session, profile, chunk_size=None):
+    from network_drawer import DrawingContext, draw_network
+
+    if session.drawing_context is None:
+        session.drawing_context = DrawingContext(session.project)
+    # Streamed networks are written straight into the output GeoPackage
+    for layer in draw_network(profile, session.drawing_context, add_to_project=False,
+                              chunk_size=chunk_size, output_path=session.output):
+        if layer.providerType() == 'memory':
+            session.keep(layer)
+        else:
+            session.use(layer)
+
+
+def line_angles_stage(session, layer, angle_field_name='line_angle', dead_band=1.0):
+    from line_angles import write_line_angles
+
+    write_line_angles(session.layer(layer), angle_field_name, dead_band)
+
+
+def span_lengths_stage(session, lines, poles=None):
+    from span_lengths import update_span_lengths
+
+    update_span_lengths(session.layer(lines),
+                        session.layer(poles) if poles else None)
+
+
+def structure_counts_stage(session, poles, structures, radii, name=None, tile_size=None, max_workers=None):
+    from structure_counts import counts_layer
+
+    session.keep(counts_layer(session.layer(poles), session.layer(structures), radii,
+                              name or f'{poles}_structure_counts', tile_size, max_workers))
+
+
+def service_areas_stage(session, poles, radius, name=None, tile_size=None, max_workers=None):
+    from service_areas import service_areas_layer
+
+    session.keep(service_areas_layer(session.layer(poles), radius, name or f'{poles}_service_areas',
+                                     tile_size=tile_size, max_workers=max_workers))
+
+
+def enclosures_stage(session, poles, connections, path=None):
+    from enclosures import save_enclosure_json, write_enclosures
+
+    rows = write_enclosures(session.layer(poles), session.layer(connections))
+    if path:
+        save_enclosure_json(rows, session.output_path(path))
+
+
+def staking_sheet_stage(session, layers, path, max_workers=None):
+    from staking_sheet import export_staking_sheet, export_staking_sheets, line_type_of
+
+    if isinstance(layers, str):
+        export_staking_sheet(session.layer(layers), session.output_path(path), line_type_of(layers))
+    else:
+        export_staking_sheets([session.layer(layer_name) for layer_name in layers],
+                              session.output_path(path), max_workers)
+
+
+# Stage name in the job file -> handler(session, **parameters)
+STAGES = {
+    'draw_network': draw_network_stage,
+    'line_angles': line_angles_stage,
+    'span_lengths': span_lengths_stage,
+    'structure_counts': structure_counts_stage,
+    'service_areas': service_areas_stage,
+    'enclosures': enclosures_stage,
+    'staking_sheet': staking_sheet_stage,
+}
+
+
+class FieldCheck:
+    # Field names of every layer as each stage of a job will find them,
+    # followed through the stages without running them, so a job with a
+    # missing layer or field fails before any stage writes to its layers
+
+    def __init__(self, project):
+        self.fields = {layer.name(): layer.fields().names()
+                       for layer in project.mapLayers().values()
+                       if isinstance(layer, QgsVectorLayer)}
+        self.problems = []
+
+    def require(self, stage_name, layer_name, field_names=()):
+        if layer_name not in self.fields:
+            self.problems.append(f'{stage_name}: layer {layer_name} not found')
+            return None
+        missing = [field_name for field_name in field_names
+                   if field_name not in self.fields[layer_name]]
+        if missing:
+            self.problems.append(
+                f'{stage_name}: {layer_name} has no {", ".join(missing)} field')
+        return self.fields[layer_name]
+
+    def add(self, layer_name, field_names):
+        known = self.fields.setdefault(layer_name, [])
+        known.extend(field_name for field_name in field_names if field_name not in known)
+
+
+def check_draw_network(check, profile, chunk_size=None):
+    from network_drawer import network_fields, resolve_profile
+
+    profile = resolve_profile(profile)
+    check.require('draw_network', profile['control_poles'], ('control_pole', 'connecting_cp'))
+    field_names = network_fields(profile).names()
+    check.fields[profile['point_layer']] = list(field_names)
+    check.fields[profile['line_layer']] = list(field_names)
+
+
+def check_line_angles(check, layer, angle_field_name='line_angle', dead_band=1.0):
+    if check.require('line_angles', layer, ('span_number', 'branch_id', 'pole_number')) is not None:
+        check.add(layer, [angle_field_name])
+
+
+def check_span_lengths(check, lines, poles=None):
+    line_fields = check.require('span_lengths', lines)
+    if line_fields is None:
+        return
+    if 'back_span' not in line_fields:
+        check.add(lines, ['span_length'])
+    if poles and check.require('span_lengths', poles, ('pole_number',)) is not None:
+        check.add(poles, ['back_span'])
+
+
+def check_structure_counts(check, poles, structures, radii, name=None, tile_size=None, max_workers=None):
+    pole_fields = check.require('structure_counts', poles)
+    check.require('structure_counts', structures)
+    if pole_fields is not None:
+        check.fields[name or f'{poles}_structure_counts'] = list(pole_fields)
+        check.add(name or f'{poles}_structure_counts', list(radii))
+
+
+def check_service_areas(check, poles, radius, name=None, tile_size=None, max_workers=None):
+    pole_fields = check.require('service_areas', poles)
+    if pole_fields is not None:
+        check.fields[name or f'{poles}_service_areas'] = list(pole_fields)
+
+
+def check_enclosures(check, poles, connections, path=None):
+    check.require('enclosures', connections, ('HubName', 'count'))
+    if check.require('enclosures', poles, ('pole_number',)) is not None:
+        check.add(poles, ['total_connections', 'enclosure'])
+
+
+def check_staking_sheet(check, layers, path, max_workers=None):
+    from staking_sheet import line_type_of, missing_staking_fields
+
+    for layer_name in [layers] if isinstance(layers, str) else layers:
+        field_names = check.require('staking_sheet', layer_name)
+        if field_names is None:
+            continue
+        line_type = line_type_of(layer_name)
+        if line_type not in ('mv', 'lv'):
+            check.problems.append(
+                f'staking_sheet: {layer_name} does not start with mv or lv')
+        missing = missing_staking_fields(field_names, line_type)
+        if missing:
+            check.problems.append(
+                f'staking_sheet: {layer_name} has no {", ".join(missing)} field')
+
+
+# Stage name -> check(FieldCheck, **parameters), same parameters as the handler
+CHECKS = {
+    'draw_network': check_draw_network,
+    'line_angles': check_line_angles,
+    'span_lengths': check_span_lengths,
+    'structure_counts': check_structure_counts,
+    'service_areas': check_service_areas,
+    'enclosures': check_enclosures,
+    'staking_sheet': check_staking_sheet,
+}
+
+
+def check_job(session, job):
+    # Open the job's project and follow its stages through their layers and
+    # fields; raises ValueError listing every problem found
+    session.open(job['project'], job.get('output'))
+    check = FieldCheck(session.project)
+    for parameters in job['stages']:
+        parameters = dict(parameters)
+        name = parameters.pop('stage')
+        if name not in STAGES:
+            check.problems.append(
+                f'Unknown stage {name}, expected one of {", ".join(STAGES)}')
+            continue
+        try:
+            CHECKS[name](check, **parameters)
+        except TypeError as e:
+            check.problems.append(f'{name}: {e}')
+    if check.problems:
+        raise ValueError(f'{job["project"]}:\n' + '\n'.join(check.problems))
+
+
+def run_job(session, job):
+    # job: {"project": path, "output": gpkg, "save_project": bool,
+    #       "stages": [{"stage": name, ...parameters}]}
+    session.open(job['project'], job.get('output'))
+    for index, parameters in enumerate(job['stages']):
+        parameters = dict(parameters)
+        name = parameters.pop('stage')
+        if name not in STAGES:
+            raise ValueError(
+                f'Unknown stage {name}, expected one of {", ".join(STAGES)}')
+        with stage(f'{index}:{name}'):
+            STAGES[name](session, **parameters)
+    if job.get('save_project'):
+        session.project.write()
+    log.info(f'{job["project"]}: results in {session.output}')
+
+
+def run_batch(jobs, report_path=None):
+    # Every job reuses the same QgsApplication, providers and transform caches
+    session = BatchSession()
+    try:
+        with run_report('batch', report_path):
+            with stage('check'):
+                for job in jobs:
+                    check_job(session, job)
+            for job in jobs:
+                with stage(os.path.basename(job['project'])):
+                    run_job(session, job)
+    finally:
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run drawing, angle, count, service area and export stages headless')
+    parser.add_argument('job_file', help='JSON job, or a list of jobs')
+    parser.add_argument('--report', help='Write the JSON run report here')
+    args = parser.parse_args()
+
+    with open(args.job_file) as job_file:
+        jobs = json.load(job_file)
+    run_batch(jobs if isinstance(jobs, list) else [jobs], args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+from staking_sheet import STAKING_FIELDS, WRITERS, staking_table
+
+# Synthetic pole layer size and the line type whose rules are applied
+pole_count = 100000
+line_type = 'lv'
+seed = 1
+
+
+def synthetic_columns(count, seed=1):
+    # The columns read_staking_columns returns for a pole layer, with a realistic
+    # mix of NULLs, guys, J10/J19 counts and K10/K30 units
+    rng = random.Random(seed)
+    values = {
+        'pole_number': [f'P{i + 1:05d}' for i in range(count)],
+        'back_span': [round(rng.uniform(30, 55), 2) for _ in range(count)],
+        'height': [rng.choice(['30ft', '35ft', '40ft']) for _ in range(count)],
+        'grounding_assembly': [rng.choice([None, 'M2-11']) for _ in range(count)],
+        'guy': [rng.choice([None, '1 x E1-2', '2 x E1-2']) for _ in range(count)],
+        'j_19': [rng.choice([None, 0, 1, 2]) for _ in range(count)],
+        'j_10': [rng.choice([None, 0, 1, 2]) for _ in range(count)],
+        'k_10': [rng.choice([None, 0, 1, 2]) for _ in range(count)],
+        'k_30': [rng.choice([None, 0, 1]) for _ in range(count)],
+        'conductor': [rng.choice(['50mm ABC', '35mm ABC']) for _ in range(count)],
+        'latitude': [rng.uniform(-15, -14) for _ in range(count)],
+        'longitude': [rng.uniform(28, 29) for _ in range(count)],
+        'streetlight': [rng.choice([None, 1]) for _ in range(count)],
+        'line_angle': [f'{rng.randint(0, 90)}°{rng.choice("LR")}' for _ in range(count)],
+        'primary_structure': [rng.choice([None, 'A1', 'A2']) for _ in range(count)],
+    }
+    return pd.DataFrame({field_name: pd.Series(values[field_name], dtype=object)
+                         for field_name in STAKING_FIELDS})
+
+
+table = staking_table(synthetic_columns(pole_count, seed), line_type)
+cells = table.size
+
+with tempfile.TemporaryDirectory() as directory:
+    print(f'{pole_count} poles, {cells} cells')
+    for output_format, writer in WRITERS.items():
+        path = os.path.join(directory, f'staking_sheet.{output_format}')
+        started = time.perf_counter()
+        try:
+            writer(table, path)
+        except ImportError as e:
+            print(f'{output_format:>8}: skipped ({str(e).splitlines()[0]})')
+            continue
+        seconds = time.perf_counter() - started
+        size_mb = os.path.getsize(path) / 2 ** 20
+        print(f'{output_format:>8}: {seconds:7.2f}s  {pole_count / seconds:10.0f} rows/s  {size_mb:6.1f} MB')
@@ -0,0 +1,79 @@
+from qgis.core import QgsWkbTypes
+
+from instrumentation import count, log
+
+
+class ControlPoleIndex:
+    # One-pass index over a control pole layer:
+    # control_pole -> (fid, point, attributes) plus the parent/child adjacency
+    # built from the connecting_cp field.
+
+    def __init__(self, layer, key_field='control_pole', parent_field='connecting_cp'):
+        if layer.geometryType() != QgsWkbTypes.PointGeometry:
+            raise ValueError('The selected layer is not a point layer')
+
+        self.layer = layer
+        self.key_field = key_field
+        self.parent_field = parent_field
+        self.poles = {}
+        self.order: list[str] = []
+        self.parent = {}
+        self.children = {}
+        self.missing_parents = []
+        self.duplicates = []
+        self.root = None
+
+        field_names = layer.fields().names()
+        count('getFeatures')
+        for feature in layer.getFeatures():
+            control_pole = feature[key_field]
+            if control_pole in self.poles:
+                # Keep the first feature, the same one the expression query returned
+                self.duplicates.append(control_pole)
+                continue
+            attributes = dict(zip(field_names, feature.attributes()))
+            self.poles[control_pole] = (
+                feature.id(), feature.geometry().asPoint(), attributes)
+            self.order.append(control_pole)
+
+        if self.order:
+            # The first control pole is the source of the network
+            self.root = self.order[0]
+
+        for control_pole in self.order[1:]:
+            connecting_cp = self.poles[control_pole][2].get(parent_field)
+            if connecting_cp not in self.poles:
+                self.missing_parents.append((control_pole, connecting_cp))
+                continue
+            self.parent[control_pole] = connecting_cp
+            self.children.setdefault(connecting_cp, []).append(control_pole)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, control_pole):
+        return control_pole in self.poles
+
+    def point(self, control_pole):
+        return self.poles[control_pole][1]
+
+    def attributes(self, control_pole):
+        return self.poles[control_pole][2]
+
+    def branches(self):
+        # (control_pole, connecting_cp) pairs in layer order, skipping the root
+        # and every control pole whose parent could not be found
+        for control_pole in self.order[1:]:
+            connecting_cp = self.parent.get(control_pole)
+            if connecting_cp is not None:
+                yield control_pole, connecting_cp
+
+    def report_missing_parents(self):
+        if self.duplicates:
+            log.warning(
+                f'{len(self.duplicates)} duplicate control poles ignored: {", ".join(map(str, self.duplicates))}')
+        if not self.missing_parents:
+            return
+        log.warning(
+            f'No connecting point found for {len(self.missing_parents)} control poles: '
+            + ', '.join(f'{control_pole} -> {connecting_cp}' for control_pole, connecting_cp in self.missing_parents))
@@ -1,32 +1,28 @@
 from qgis.core import QgsProject
-from qgis.analysis import QgsNativeAlgorithms
-import processing
-from processing.core.Processing import Processing
 
-Processing.initialize()
-QgsApplication.processingRegistry().addProvider(QgsNativeAlgorithms())
+from instrumentation import run_report
+from service_areas import service_areas_layer
 
-# Load the point layer
-pointLayer = QgsProject.instance().mapLayersByName('lv_poles_nalusanga')[0]
-
-# Generate a buffer around each point
-buffer_parameters = {"INPUT": pointLayer,
-                     "DISTANCE": 30,
-                     "OUTPUT": 'memory:'}
-buffered = processing.run("native:buffer", buffer_parameters)['OUTPUT']
+layer_name = 'lv_poles_nalusanga'
+# Service area radius around every pole, in metres
+radius = 30
+# Tile size in metres for splitting large layers into tiles, None runs in one
+# piece. The tiles run in this process (max_workers=0): the QGIS desktop's
+# interpreter cannot start pool workers, headless batch jobs can use a pool
+tile_size = None
+max_workers = 0
+# Path of the JSON run report, None only logs the stage summaries
+report_path = None
 
-# Generate Voronoi Polygons based on original point layer
-voronoi_parameters = {"INPUT": pointLayer,
-                      "BUFFER": 0.1,
-                      "OUTPUT": 'memory:'}
-voronoi_layer = processing.run(
-    "qgis:voronoipolygons", voronoi_parameters)['OUTPUT']
+# Load the point layer
+pointLayer = QgsProject.instance().mapLayersByName(layer_name)[0]
 
-# Clip the Voronoi polygons with the buffer layer
-clip_parameters = {"INPUT": voronoi_layer,
-                   "OVERLAY": buffered,
-                   "OUTPUT": 'memory:'}
-clipped_voronoi = processing.run("qgis:clip", clip_parameters)['OUTPUT']
+with run_report('voronoi_service_areas', report_path):
+    # Voronoi cells of the poles, each clipped to its own pole's metric buffer in
+    # one pass and carrying that pole's attributes; no Processing setup needed
+    clipped_voronoi = service_areas_layer(
+        pointLayer, radius, f'{layer_name}_service_areas',
+        tile_size=tile_size, max_workers=max_workers)
 
 # Add the clipped voronoi layer to the map
 QgsProject.instance().addMapLayer(clipped_voronoi)
@@ -0,0 +1,2 @@
+# Kept for existing imports; the densification lives in geometry_core.densify
+from geometry_core.densify import interpolate_spans
@@ -0,0 +1,7 @@
+from network_drawer import draw_networks
+
+# Draw MV and LV for several minigrids in one run; layers, control pole indexes
+# and coordinate transforms are loaded once and shared by every profile
+profiles = ['nalusanga_mv', 'manyani_mv', 'manyani_lv']
+
+draw_networks(profiles)
@@ -0,0 +1,97 @@
+# Declarative profiles for network_drawer.draw_networks.
+#
+# control_poles  name of the control pole layer (control_pole / connecting_cp fields)
+# point_layer    name of the new memory layer for the poles
+# line_layer     name of the new memory layer for the spans
+# prefix         pole number prefix (P01, LV01, MV01, ...)
+# min_span       minimum span length in metres
+# max_span       maximum span length in metres
+# span_rules     site overrides, the first matching rule wins:
+#                control_pole_prefix  control poles whose name starts with this prefix
+#                min_length/max_length  branches with min_length < length <= max_length
+#                min_span/max_span      the span limits of the matching branches
+# drop_straight_control_poles  plan straight runs of control poles as a whole and
+#                leave out the poles of the control poles that are not needed;
+#                False (the default) splits every surveyed control pole segment
+#                on its own; only enable it for sites whose straight-run control
+#                poles are not surveyed positions, as it changes the branches
+# max_straight_run     most control poles one planned run may bridge (8)
+# max_straight_angle   largest turn in degrees at a control pole that may be dropped (2.0)
+# max_straight_offset  largest distance in metres from a dropped control pole to its span (1.0)
+# copy_fields    control pole attributes copied onto the generated poles and lines
+# pole_number_width  zero-padding of the pole numbers (P01, P161), 'auto' pads to fit the pole count
+# chunk_size     stream the network to its layers this many poles at a time
+#                into GeoPackage layers (bounded memory for very large designs),
+#                None builds it in memory layers in one go
+# output_path    GeoPackage of a streamed network, networks.gpkg next to the project by default
+
+MV = {
+    'prefix': 'MV',
+    'min_span': 60,
+    'max_span': 110,
+    'span_rules': [],
+    'copy_fields': [],
+    'pole_number_width': 2,
+    'drop_straight_control_poles': False,
+    'max_straight_angle': 2.0,
+    'max_straight_offset': 1.0,
+    'max_straight_run': 8,
+}
+
+LV = {
+    'prefix': 'LV',
+    'min_span': 35,
+    'max_span': 55,
+    'span_rules': [],
+    'copy_fields': [],
+    'pole_number_width': 2,
+    'drop_straight_control_poles': False,
+    'max_straight_angle': 2.0,
+    'max_straight_offset': 1.0,
+    'max_straight_run': 8,
+}
+
+PROFILES = {
+    'aml': {
+        **LV,
+        'control_poles': 'control_poles',
+        'point_layer': 'new_pole_points_aml',
+        'line_layer': 'line_layer_aml',
+        'prefix': 'P',
+        'min_span': 100,
+        'max_span': 110,
+        'span_rules': [
+            {'control_pole_prefix': 'CP_13', 'min_span': 122, 'max_span': 125},
+            {'min_length': 110, 'max_length': 116,
+             'min_span': 110, 'max_span': 116},
+        ],
+    },
+    'nalusanga_mv': {
+        **MV,
+        'control_poles': 'nalusanga_mv_control_poles',
+        'point_layer': 'new_mv_pole_points',
+        'line_layer': 'mv_line_layer',
+    },
+    'nalusanga_lv': {
+        **LV,
+        'control_poles': 'lv_poles_nalusanga',
+        'point_layer': 'new_pole_points',
+        'line_layer': 'line_layer',
+        'max_span': 56,
+    },
+    'manyani_mv': {
+        **MV,
+        'control_poles': 'mv_control_poles',
+        'point_layer': 'new_manyani_mv_pole_points',
+        'line_layer': 'manyani_mv_line_layer',
+        'max_span': 115,
+    },
+    'manyani_lv': {
+        **LV,
+        'control_poles': 'manyani_lv_control_points',
+        'point_layer': 'new_manyani_lv_pole_points',
+        'line_layer': 'manyani_lv_line_layer',
+        'max_span': 57,
+        'copy_fields': ['transformer'],
+    },
+}
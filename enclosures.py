@@ -0,0 +1,105 @@
+import json
+import math
+
+from qgis.core import NULL, QgsFeatureRequest, QgsField, QgsFields
+from qgis.PyQt.QtCore import QVariant
+
+from instrumentation import count, stage
+
+
+def hub_connection_totals(connection_layer, hub_field='HubName', count_field='count'):
+    # Sum of count per hub in one pass over the connections, i.e. the
+    # aggregate(sum, "count", filter:="HubName" = pole_number) of every pole at once
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry) \
+        .setSubsetOfAttributes([hub_field, count_field], connection_layer.fields())
+    totals = {}
+    count('getFeatures')
+    for feature in connection_layer.getFeatures(request):
+        hub, connections = feature[hub_field], feature[count_field]
+        if hub == NULL or connections == NULL:
+            continue
+        totals[hub] = totals.get(hub, 0) + connections
+    return totals
+
+
+def number_text(value):
+    # to_string() of a whole number without the trailing .0
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def enclosure_text(total_connections):
+    # Same cases as the enclosure expression in write_enclosures.json
+    if total_connections is None:
+        return None
+    if total_connections in (1, 2, 3):
+        return f'{number_text(total_connections)}xOne-meter Enclosure'
+    if total_connections == 4:
+        return '1xFour-meter Enclosure'
+    text = f'{math.floor(total_connections / 4.0)}xFour-meter Enclosure'
+    remainder = total_connections % 4
+    if remainder != 0:
+        text += f' and {number_text(remainder)}xOne-meter Enclosure'
+    return text
+
+
+def pole_enclosures(poles_layer, totals, pole_number_field='pole_number'):
+    # (fid, pole_number, total_connections, enclosure) for every pole in layer
+    # order; poles without connections get None like the NULL aggregate
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry) \
+        .setSubsetOfAttributes([pole_number_field], poles_layer.fields())
+    rows = []
+    count('getFeatures')
+    for feature in poles_layer.getFeatures(request):
+        pole_number = feature[pole_number_field]
+        total_connections = totals.get(pole_number)
+        rows.append((feature.id(), pole_number, total_connections,
+                     enclosure_text(total_connections)))
+    return rows
+
+
+def real_field(layer, field_name, field_type):
+    # Index of a stored field, replacing a virtual (expression) field of the
+    # same name, which the provider cannot write to
+    fields = layer.fields()
+    index = fields.indexFromName(field_name)
+    if index >= 0 and fields.fieldOrigin(index) == QgsFields.OriginExpression:
+        layer.removeExpressionField(index)
+        index = -1
+    if index < 0:
+        layer.dataProvider().addAttributes([QgsField(field_name, field_type)])
+        layer.updateFields()
+        index = layer.fields().indexFromName(field_name)
+    return index
+
+
+def write_enclosures(poles_layer, connection_layer, total_field='total_connections',
+                     enclosure_field='enclosure', pole_number_field='pole_number'):
+    # Join the hub totals onto the poles and store total_connections and the
+    # enclosure text as real fields with one bulk update
+    with stage('hub_totals') as record:
+        totals = hub_connection_totals(connection_layer)
+        record['features'] = len(totals)
+    with stage('join', poles_layer.featureCount()):
+        rows = pole_enclosures(poles_layer, totals, pole_number_field)
+
+    with stage('write', len(rows)):
+        total_index = real_field(poles_layer, total_field, QVariant.Int)
+        enclosure_index = real_field(
+            poles_layer, enclosure_field, QVariant.String)
+        attr_map = {fid: {total_index: NULL if total_connections is None else total_connections,
+                          enclosure_index: NULL if enclosure is None else enclosure}
+                    for fid, _, total_connections, enclosure in rows}
+        poles_layer.dataProvider().changeAttributeValues(attr_map)
+    return rows
+
+
+def enclosure_records(rows):
+    # enclosure.json entries: "<enclosure>~<pole_number>" for poles with connections
+    return [{'enclosure': f'{enclosure}~{pole_number}'}
+            for _, pole_number, _, enclosure in rows if enclosure is not None]
+
+
+def save_enclosure_json(rows, path):
+    with open(path, 'w') as json_file:
+        json.dump(enclosure_records(rows), json_file, indent=2)
+    return path
@@ -0,0 +1,46 @@
+from qgis.core import QgsApplication, QgsProject
+from datetime import datetime
+import os
+
+from instrumentation import run_report
+from staking_sheet import export_staking_sheets
+
+# Pole layers to export, one sheet each; mv/lv rules follow the layer name prefix
+layer_names = ['mv_poles', 'lv_poles - design_grid_extension']
+# Project to load when running outside the QGIS desktop, e.g. from a nightly job
+project_path = None
+output_directory = ''
+# Processes building the sheets; 0 builds them in this process. None uses one
+# per core when run headless and 0 inside QGIS, whose executable cannot be
+# started as a plain worker process
+max_workers = None
+# Path of the JSON run report, None only logs the stage summaries
+report_path = None
+
+# Worker processes started with spawn/forkserver import this file again, the
+# guard keeps them from starting QGIS and the export themselves
+if __name__ == '__main__':
+    headless = QgsApplication.instance() is None
+    if headless:
+        # Headless run without the QGIS desktop
+        qgs = QgsApplication([], False)
+        qgs.initQgis()
+    if project_path:
+        QgsProject.instance().read(project_path)
+
+    current_timestamp = datetime.now()
+    output_excel_file = os.path.join(
+        output_directory, f'{str(current_timestamp).replace(":", "-")}_staking_sheets.xlsx')
+
+    with run_report('staking_sheets', report_path):
+        layers = []
+        for layer_name in layer_names:
+            found = QgsProject.instance().mapLayersByName(layer_name)
+            if not found:
+                raise ValueError(f'Layer {layer_name} not found')
+            layers.append(found[0])
+
+        summary = export_staking_sheets(
+            layers, output_excel_file, max_workers if max_workers is not None else (None if headless else 0))
+        print(summary.to_string(index=False))
+        print(f'Exported {len(layers)} layers to {output_excel_file}')
@@ -0,0 +1,220 @@
+import json
+import re
+
+from qgis.core import (NULL, QgsExpression, QgsExpressionContext, QgsExpressionContextUtils,
+                       QgsFeatureRequest, QgsField, QgsProject, QgsVectorLayer, qgsfunction)
+from qgis.PyQt.QtCore import QVariant
+
+from instrumentation import count, log, stage
+
+
+def load_expression_library(path='write_enclosures.json'):
+    # {name: expression} from a QGIS user expression export, in file order
+    with open(path, encoding='utf-8') as library_file:
+        library = json.load(library_file)
+    return {entry['name']: entry['expression'] for entry in library['expressions']
+            if entry.get('type', 'expression') == 'expression'}
+
+
+# (layer id, attribute) -> (layer data version, {value: feature}), shared by all
+# expressions so every get_feature lookup table is built once per layer edit
+_lookup_cache = {}
+_layer_versions = {}
+
+
+def _bump_layer_version(layer_id):
+    _layer_versions[layer_id] = _layer_versions.get(layer_id, 0) + 1
+
+
+def layer_version(layer):
+    if layer.id() not in _layer_versions:
+        _layer_versions[layer.id()] = 0
+        layer_id = layer.id()
+        layer.dataChanged.connect(lambda: _bump_layer_version(layer_id))
+    return _layer_versions[layer.id()]
+
+
+def resolve_layer(layer):
+    # get_feature accepts a layer, a layer id or a layer name
+    if isinstance(layer, QgsVectorLayer):
+        return layer
+    project = QgsProject.instance()
+    return project.mapLayer(layer) or next(iter(project.mapLayersByName(layer)), None)
+
+
+def lookup_table(layer, attribute):
+    # {attribute value: first feature with that value}, like get_feature
+    version = layer_version(layer)
+    key = (layer.id(), attribute)
+    cached = _lookup_cache.get(key)
+    if cached is None or cached[0] != version:
+        table = {}
+        count('getFeatures')
+        for feature in layer.getFeatures():
+            table.setdefault(feature[attribute], feature)
+        cached = _lookup_cache[key] = (version, table)
+    return cached[1]
+
+
+@qgsfunction(args='auto', group='Custom', referenced_columns=[])
+def cached_get_feature(layer, attribute, value, feature, parent):
+    """
+    Same as get_feature(layer, attribute, value), but the lookup table of the
+    layer is built once and reused until the layer is edited.
+    """
+    layer = resolve_layer(layer)
+    if layer is None:
+        return None
+    return lookup_table(layer, attribute).get(value)
+
+
+GET_FEATURE = re.compile(r'\bget_feature\s*\(')
+
+
+def cached_expression(expression):
+    # Route get_feature() lookups through cached_get_feature()
+    return GET_FEATURE.sub('cached_get_feature(', expression)
+
+
+class MaterializedExpressions:
+    # Evaluates a set of expressions over every feature of a layer in batch and
+    # keeps the results in columns keyed by (fid, edit version). Editing a
+    # feature bumps its version, editing any other layer bumps the epoch of
+    # every column, and evaluate() only recomputes the stale entries.
+
+    def __init__(self, layer, expressions):
+        self.layer = layer
+        self.expressions = {}
+        for name, text in expressions.items():
+            expression = QgsExpression(cached_expression(text))
+            if expression.hasParserError():
+                raise ValueError(
+                    f'Cannot parse expression {name}: {expression.parserErrorString()}')
+            self.expressions[name] = expression
+        self.columns = {name: {} for name in self.expressions}
+        self.versions = {}
+
+        layer.attributeValueChanged.connect(self.on_feature_changed)
+        layer.geometryChanged.connect(self.on_feature_changed)
+        layer.featureAdded.connect(self.on_feature_changed)
+        layer.featureDeleted.connect(self.on_feature_deleted)
+        layer.afterCommitChanges.connect(self.drop_temporary_fids)
+        layer.afterRollBack.connect(self.drop_temporary_fids)
+
+    def disconnect(self):
+        self.layer.attributeValueChanged.disconnect(self.on_feature_changed)
+        self.layer.geometryChanged.disconnect(self.on_feature_changed)
+        self.layer.featureAdded.disconnect(self.on_feature_changed)
+        self.layer.featureDeleted.disconnect(self.on_feature_deleted)
+        self.layer.afterCommitChanges.disconnect(self.drop_temporary_fids)
+        self.layer.afterRollBack.disconnect(self.drop_temporary_fids)
+
+    def on_feature_changed(self, fid, *args):
+        self.versions[fid] = self.versions.get(fid, 0) + 1
+
+    def on_feature_deleted(self, fid):
+        self.versions.pop(fid, None)
+        for column in self.columns.values():
+            column.pop(fid, None)
+
+    def drop_temporary_fids(self):
+        # Features added while editing have negative ids until the commit, which
+        # gives them new ones (or the rollback, which drops them). The committed
+        # features are simply stale under their new ids.
+        for fids in [self.versions] + list(self.columns.values()):
+            for fid in [fid for fid in fids if fid < 0]:
+                del fids[fid]
+
+    def epoch(self):
+        # Changes whenever any other layer this project looks up into is edited
+        return tuple(sorted((layer_id, version) for layer_id, version in _layer_versions.items()
+                            if layer_id != self.layer.id()))
+
+    def version(self, fid):
+        return self.versions.get(fid, 0)
+
+    def stale_fids(self, name, epoch):
+        column = self.columns[name]
+        return [fid for fid in self.layer.allFeatureIds()
+                if column.get(fid, (None,))[0] != (self.version(fid), epoch)]
+
+    def evaluate(self, names=None):
+        # Recompute the stale entries of the given (default: all) columns
+        context = QgsExpressionContext(
+            QgsExpressionContextUtils.globalProjectLayerScopes(self.layer))
+        for name in names or self.expressions:
+            expression = self.expressions[name]
+            epoch = self.epoch()
+            stale = self.stale_fids(name, epoch)
+            if not stale:
+                continue
+            with stage(f'evaluate:{name[:40]}', len(stale)):
+                expression.prepare(context)
+                request = QgsFeatureRequest().setFilterFids(stale)
+                if not expression.needsGeometry():
+                    request.setFlags(QgsFeatureRequest.NoGeometry)
+                count('getFeatures')
+                column = self.columns[name]
+                errors = 0
+                for feature in self.layer.getFeatures(request):
+                    context.setFeature(feature)
+                    value = expression.evaluate(context)
+                    if expression.hasEvalError():
+                        errors += 1
+                        value = None
+                    column[feature.id()] = ((self.version(feature.id()), epoch),
+                                            None if value == NULL else value)
+                # cached_get_feature may have built new lookup tables
+                epoch_after = self.epoch()
+                if epoch_after != epoch:
+                    for fid in stale:
+                        if fid in column:
+                            column[fid] = ((column[fid][0][0], epoch_after), column[fid][1])
+                if errors:
+                    log.warning(
+                        f'{errors} features failed to evaluate {name}: {expression.evalErrorString()}')
+
+    def value(self, name, fid):
+        self.evaluate([name])
+        return self.columns[name][fid][1]
+
+    def column(self, name):
+        # {fid: value}
+        self.evaluate([name])
+        return {fid: value for fid, (_, value) in self.columns[name].items()}
+
+    def field_type(self, name):
+        # Field type that holds every value of a column: Int, Double or String
+        values = [value for _, value in self.columns[name].values() if value is not None]
+        if values and all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            return QVariant.LongLong if any(abs(value) >= 2 ** 31 for value in values) else QVariant.Int
+        if values and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            return QVariant.Double
+        return QVariant.String
+
+    def write(self, fields, field_types=None):
+        # Store columns as real fields, {expression name: field name}, with one
+        # bulk update so labels and renderers read plain attributes. New fields
+        # take their type from field_types ({field name: QVariant type}) or
+        # from the values of the column.
+        self.evaluate(list(fields))
+        field_types = field_types or {}
+        provider = self.layer.dataProvider()
+        missing = [QgsField(field_name, field_types.get(field_name) or self.field_type(name))
+                   for name, field_name in fields.items()
+                   if self.layer.fields().indexFromName(field_name) < 0]
+        if missing:
+            provider.addAttributes(missing)
+            self.layer.updateFields()
+
+        attr_map = {}
+        for name, field_name in fields.items():
+            field_index = self.layer.fields().indexFromName(field_name)
+            for fid, (_, value) in self.columns[name].items():
+                if fid < 0:
+                    # Not in the provider until the edits are committed
+                    continue
+                attr_map.setdefault(fid, {})[field_index] = NULL if value is None else value
+        with stage('write_columns', len(attr_map)):
+            provider.changeAttributeValues(attr_map)
+        return attr_map
@@ -0,0 +1,9 @@
+# Array-in, array-out geometry used by the QGIS scripts. Nothing here imports
+# QGIS, so it runs in plain worker processes; pyproj is only loaded when
+# coordinates are projected.
+from geometry_core.angles import angle_labels, azimuths, next_span_index, span_angles
+from geometry_core.densify import interpolate_spans
+from geometry_core.geodesic import geodesic_inverse, geodesic_lengths
+from geometry_core.neighbours import count_within_radii
+from geometry_core.projection import transform_coords, utm_epsg_codes
+from geometry_core.spans import points_distance, polyline_lengths
@@ -0,0 +1,40 @@
+import numpy as np
+
+
+def azimuths(starts, ends):
+    # Same convention as QgsPointXY.azimuth: degrees clockwise from north
+    delta = np.asarray(ends, dtype=float) - np.asarray(starts, dtype=float)
+    return np.degrees(np.arctan2(delta[:, 0], delta[:, 1]))
+
+
+def next_span_index(span_numbers):
+    # Index of the first span whose span_number is span_number + 1, -1 when there is none.
+    # span_numbers must be sorted.
+    span_numbers = np.asarray(span_numbers, dtype=float)
+    wanted = span_numbers + 1
+    index = np.searchsorted(span_numbers, wanted, side='left')
+    found = index < len(span_numbers)
+    found[found] = span_numbers[index[found]] == wanted[found]
+    return np.where(found, index, -1)
+
+
+def span_angles(starts, ends, span_numbers, dead_band=1.0):
+    # Deflection between every span and the next one, wrapped to [-180, 180]
+    # with everything below the dead-band snapped to 0
+    line_azimuth = azimuths(starts, ends)
+    next_index = next_span_index(span_numbers)
+    has_next = next_index >= 0
+    angles = np.zeros(len(line_azimuth))
+    angles[has_next] = line_azimuth[has_next] - \
+        line_azimuth[next_index[has_next]]
+    angles[angles > 180] -= 360
+    angles[angles < -180] += 360
+    angles[np.abs(angles) < dead_band] = 0
+    return angles
+
+
+def angle_labels(angles):
+    # 12°L for left turns, 12°R for right turns, 0° when straight
+    degrees = np.abs(np.round(angles)).astype(np.int64).astype(str)
+    suffix = np.where(angles > 0, '°L', np.where(angles < 0, '°R', '°'))
+    return np.char.add(degrees, suffix)
@@ -0,0 +1,24 @@
+import numpy as np
+
+
+def interpolate_spans(starts, ends, counts):
+    # Split every start -> end segment into counts[i] equal parts with parametric
+    # interpolation (no slope, so vertical segments are fine).
+    # Returns the new pole coordinates (the end point is the last pole of each
+    # segment, the start point is not repeated) and the offsets of each segment
+    # into that array: segment i owns rows offsets[i]:offsets[i + 1].
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    ends = np.asarray(ends, dtype=float).reshape(-1, 2)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    segment_index = np.repeat(np.arange(len(counts)), counts)
+    position = np.arange(offsets[-1]) - offsets[segment_index] + 1
+    t = position / counts[segment_index]
+
+    coords = starts[segment_index] + \
+        (ends - starts)[segment_index] * t[:, np.newaxis]
+    return coords, offsets
+
@@ -0,0 +1,29 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=None)
+def geod(ellps='WGS84'):
+    # pyproj is only needed once distances are actually measured
+    from pyproj import Geod
+
+    return Geod(ellps=ellps)
+
+
+def geodesic_inverse(lonlat_a, lonlat_b):
+    # Inverse geodesic problem on WGS84 for arrays of (lon, lat) degree pairs.
+    # Returns the distances in metres and the forward azimuths in degrees
+    # clockwise from north.
+    lonlat_a = np.asarray(lonlat_a, dtype=float).reshape(-1, 2)
+    lonlat_b = np.asarray(lonlat_b, dtype=float).reshape(-1, 2)
+    if len(lonlat_a) == 0:
+        return np.zeros(0), np.zeros(0)
+    azimuths, _, distances = geod().inv(
+        lonlat_a[:, 0], lonlat_a[:, 1], lonlat_b[:, 0], lonlat_b[:, 1])
+    return np.asarray(distances, dtype=float), np.asarray(azimuths, dtype=float)
+
+
+def geodesic_lengths(lonlat_a, lonlat_b):
+    return geodesic_inverse(lonlat_a, lonlat_b)[0]
+
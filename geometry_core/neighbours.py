@@ -0,0 +1,55 @@
+import numpy as np
+
+
+# Neighbouring grid cells, including the cell itself
+NEIGHBOURS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+
+def count_within_radii(points, structures, radii, chunk_size=100000):
+    # Number of structures within each radius (metres, inclusive) of every point.
+    # points and structures are (n, 2) projected coordinates. Structures are
+    # bucketed in a grid whose cell size is the largest radius, so every query
+    # only looks at the 3x3 cells around its point.
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    structures = np.asarray(structures, dtype=float).reshape(-1, 2)
+    radii = np.atleast_1d(np.asarray(radii, dtype=float))
+    counts = np.zeros((len(radii), len(points)), dtype=np.int64)
+    if len(points) == 0 or len(structures) == 0:
+        return counts
+
+    cell_size = radii.max()
+    origin = structures.min(axis=0)
+    structure_cells = np.floor((structures - origin) / cell_size).astype(np.int64)
+    grid_height = structure_cells[:, 1].max() + 1
+    grid_width = structure_cells[:, 0].max() + 1
+    keys = structure_cells[:, 0] * grid_height + structure_cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    structures = structures[order]
+    squared_radii = radii ** 2
+
+    for chunk_start in range(0, len(points), chunk_size):
+        chunk = points[chunk_start:chunk_start + chunk_size]
+        chunk_cells = np.floor((chunk - origin) / cell_size).astype(np.int64)
+        for dx, dy in NEIGHBOURS:
+            cx = chunk_cells[:, 0] + dx
+            cy = chunk_cells[:, 1] + dy
+            inside = (cx >= 0) & (cx < grid_width) & (cy >= 0) & (cy < grid_height)
+            cell_keys = cx * grid_height + cy
+            starts = np.searchsorted(keys, cell_keys, side='left')
+            ends = np.searchsorted(keys, cell_keys, side='right')
+            lengths = np.where(inside, ends - starts, 0)
+            total = lengths.sum()
+            if total == 0:
+                continue
+
+            # Expand every (point, candidate structure) pair of this cell offset
+            point_index = np.repeat(np.arange(len(chunk)), lengths)
+            first = np.repeat(np.cumsum(lengths) - lengths, lengths)
+            structure_index = np.repeat(starts, lengths) + np.arange(total) - first
+            delta = structures[structure_index] - chunk[point_index]
+            squared = np.einsum('ij,ij->i', delta, delta)
+            for r, squared_radius in enumerate(squared_radii):
+                counts[r, chunk_start:chunk_start + len(chunk)] += np.bincount(
+                    point_index[squared <= squared_radius], minlength=len(chunk))
+    return counts
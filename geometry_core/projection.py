@@ -0,0 +1,29 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+def utm_epsg_codes(lonlat):
+    # UTM EPSG code for every (lon, lat) point
+    lonlat = np.asarray(lonlat, dtype=float).reshape(-1, 2)
+    zones = np.floor((lonlat[:, 0] + 180) / 6).astype(int) + 1
+    return np.where(lonlat[:, 1] >= 0, 32600, 32700) + zones
+
+
+@lru_cache(maxsize=None)
+def transformer(source_epsg: int, destination_epsg: int):
+    # pyproj is only needed once coordinates are actually projected
+    from pyproj import Transformer
+
+    return Transformer.from_crs(source_epsg, destination_epsg, always_xy=True)
+
+
+def transform_coords(coords, source_epsg, destination_epsg):
+    # (n, 2) x/y (lon/lat for geographic CRSs) from one EPSG code to another
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if source_epsg == destination_epsg or len(coords) == 0:
+        return coords.copy()
+    x, y = transformer(int(source_epsg), int(destination_epsg)).transform(
+        coords[:, 0], coords[:, 1])
+    return np.column_stack([x, y])
+
@@ -0,0 +1,31 @@
+import numpy as np
+
+from geometry_core.geodesic import geodesic_lengths
+
+
+def points_distance(total_distances, min_distance=35, max_distance=55):
+    # Array version of util_services.calculate_points_distance: the number of
+    # spans of at most max_distance in every total, and their length. Totals
+    # shorter than min_distance get no spans and keep their length.
+    total_distances = np.asarray(total_distances, dtype=float)
+    counts = np.ceil(total_distances / max_distance)
+    short = total_distances < min_distance
+    counts[short] = 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lengths = np.where(short, total_distances, total_distances / counts)
+    return counts, lengths
+
+
+def polyline_lengths(lonlat, offsets):
+    # Geodesic length of every polyline. lonlat holds the (lon, lat) vertices of
+    # all lines one after the other, line i owns rows offsets[i]:offsets[i + 1].
+    lonlat = np.asarray(lonlat, dtype=float).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    line_count = len(offsets) - 1
+    line_index = np.repeat(np.arange(line_count), np.diff(offsets))
+    # Only the segments between two vertices of the same line count, so empty
+    # and single-vertex lines get 0 and no line is joined to the next one
+    within = line_index[:-1] == line_index[1:]
+    segments = geodesic_lengths(lonlat[:-1][within], lonlat[1:][within])
+    return np.bincount(line_index[:-1][within], weights=segments,
+                       minlength=line_count).astype(float)
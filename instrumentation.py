@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Per-feature messages are logged at DEBUG, stage summaries at INFO.
+# QGIS_AUTOMATION_LOG=DEBUG turns the verbose output on.
+log = logging.getLogger('qgis_automation')
+if not log.handlers:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+    log.addHandler(handler)
+    log.setLevel(os.environ.get('QGIS_AUTOMATION_LOG', 'INFO').upper())
+    log.propagate = False
+
+
+def set_verbosity(level):
+    log.setLevel(level)
+
+
+def debug_enabled():
+    # Guard per-feature logging with this so it costs nothing when off
+    return log.isEnabledFor(logging.DEBUG)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class RunReport:
+    # Wall time, feature counts, call counters and peak memory per stage
+
+    def __init__(self, name, trace_memory=False):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.counters = Counter()
+        self.stages = []
+        self._stack = []
+        self._started = time.perf_counter()
+        self._started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self._owns_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._owns_tracing:
+            tracemalloc.start()
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    @contextmanager
+    def stage(self, name, features=None):
+        self._stack.append(name)
+        record = {'stage': '/'.join(self._stack), 'features': features}
+        counters_before = Counter(self.counters)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - started, 4)
+            record['counters'] = dict(self.counters - counters_before)
+            if self.trace_memory:
+                record['peak_traced_mb'] = round(
+                    tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            record['peak_rss_mb'] = peak_rss_mb()
+            self.stages.append(record)
+            self._stack.pop()
+            log.info(
+                f'{record["stage"]}: {record["seconds"]:.3f}s, features={record["features"]}')
+
+    def as_dict(self):
+        return {
+            'run': self.name,
+            'started_at': self._started_at,
+            'seconds': round(time.perf_counter() - self._started, 4),
+            'peak_rss_mb': peak_rss_mb(),
+            'counters': dict(self.counters),
+            'stages': self.stages,
+        }
+
+    def to_json(self, path=None):
+        text = json.dumps(self.as_dict(), indent=2, default=str)
+        if path:
+            with open(path, 'w') as report_file:
+                report_file.write(text)
+        return text
+
+
+_active = None
+
+
+def active_report():
+    return _active
+
+
+def count(counter, n=1):
+    # No-op unless a run report is active
+    if _active is not None:
+        _active.count(counter, n)
+
+
+def stage(name, features=None):
+    if _active is None:
+        return nullcontext({'stage': name, 'features': features})
+    return _active.stage(name, features)
+
+
+@contextmanager
+def run_report(name, path=None, trace_memory=False):
+    # Activate a report for the duration of a run and write it as JSON at the end.
+    # Nested runs (e.g. a batch calling several scripts) report into the outer one.
+    global _active
+    if _active is not None:
+        with _active.stage(name):
+            yield _active
+        return
+
+    report = RunReport(name, trace_memory)
+    _active = report
+    try:
+        yield report
+    finally:
+        _active = None
+        if report._owns_tracing:
+            tracemalloc.stop()
+        report.to_json(path)
+        log.info(f'{name} finished in {report.as_dict()["seconds"]:.3f}s'
+                 + (f', report written to {path}' if path else ''))
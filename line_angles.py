@@ -0,0 +1,247 @@
+import numpy as np
+from qgis.core import QgsField
+from qgis.PyQt.QtCore import QTimer, QVariant
+
+from geometry_core.angles import angle_labels, span_angles
+from instrumentation import count, debug_enabled, log, stage
+
+
+def line_ends(geometry):
+    # First and last vertex of a (multi)line, None for an empty geometry.
+    # Multipart spans run from the start of the first part to the end of the last.
+    parts = geometry.asMultiPolyline() if geometry.isMultipart() else [geometry.asPolyline()]
+    parts = [part for part in parts if part]
+    if not parts:
+        return None
+    return parts[0][0], parts[-1][-1]
+
+
+def read_spans(layer):
+    # Pull span endpoints and the attributes the angle logic needs into arrays,
+    # reading every feature and its geometry exactly once
+    fids, span_numbers, branch_ids, pole_numbers, span_starts, span_ends = [], [], [], [], [], []
+    count('getFeatures')
+    for feature in layer.getFeatures():
+        ends = line_ends(feature.geometry())
+        if ends is None:
+            continue
+        start, end = ends
+        span_number = feature['span_number']
+        fids.append(feature.id())
+        span_numbers.append(np.nan if span_number is None else span_number)
+        branch_ids.append(feature['branch_id'])
+        pole_numbers.append(feature['pole_number'])
+        span_starts.append((start.x(), start.y()))
+        span_ends.append((end.x(), end.y()))
+
+    try:
+        span_numbers = np.array(span_numbers, dtype=float)
+    except (TypeError, ValueError) as e:
+        raise TypeError(f"Invalid type for 'span_number' in feature: {e}")
+    # Stable sort keeps layer order for equal span numbers, like list.sort
+    order = np.argsort(span_numbers, kind='stable')
+    return {
+        'fids': np.array(fids, dtype=np.int64)[order],
+        'span_numbers': span_numbers[order],
+        'branch_ids': np.array(branch_ids, dtype=object)[order],
+        'pole_numbers': np.array(pole_numbers, dtype=object)[order],
+        'starts': np.array(span_starts, dtype=float).reshape(-1, 2)[order],
+        'ends': np.array(span_ends, dtype=float).reshape(-1, 2)[order],
+    }
+
+
+def compute_line_angles(spans, dead_band=1.0):
+    # {fid: angle label}; the first (lowest span_number) span of a pole on a
+    # non-deadend branch sets its label, every other pole is a deadend
+    labels = angle_labels(span_angles(
+        spans['starts'], spans['ends'], spans['span_numbers'], dead_band))
+    eligible = np.flatnonzero(spans['branch_ids'] != 'deadend')
+
+    angles = {}
+    for index in eligible:
+        angles.setdefault(spans['pole_numbers'][index], labels[index])
+
+    return {int(fid): str(angles.get(pole_number, 'deadend'))
+            for fid, pole_number in zip(spans['fids'], spans['pole_numbers'])}
+
+
+def write_line_angles(layer, angle_field_name='line_angle', dead_band=1.0):
+    with stage('read_spans') as record:
+        spans = read_spans(layer)
+        record['features'] = len(spans['fids'])
+    with stage('compute_angles', len(spans['fids'])):
+        angles = compute_line_angles(spans, dead_band)
+    if debug_enabled():
+        for span_number, fid in zip(spans['span_numbers'], spans['fids']):
+            log.debug(f'{span_number} {angles[int(fid)]}')
+
+    with stage('write_angles', len(angles)):
+        if angle_field_name not in layer.fields().names():
+            layer.dataProvider().addAttributes(
+                [QgsField(angle_field_name, QVariant.String, len=10)])
+            layer.updateFields()
+        angle_field_index = layer.fields().indexFromName(angle_field_name)
+
+        attr_map = {fid: {angle_field_index: angle}
+                    for fid, angle in angles.items()}
+        layer.dataProvider().changeAttributeValues(attr_map)
+    return angles
+
+
+class IncrementalLineAngles:
+    # Keeps the angle field up to date while a layer is being edited.
+    # Geometry/attribute edits mark span numbers dirty and flush() recomputes
+    # only the affected poles (the edited span and the span before it, whose
+    # angle depends on it) and writes just those attributes.
+
+    tracked_fields = ('span_number', 'branch_id', 'pole_number')
+
+    def __init__(self, layer, angle_field_name='line_angle', dead_band=1.0, auto_flush=True):
+        self.layer = layer
+        self.angle_field_name = angle_field_name
+        self.dead_band = dead_band
+        self.auto_flush = auto_flush
+        self.dirty_spans = set()
+        # Poles whose spans changed: a renamed or deleted span leaves its old
+        # pole to be relabelled from the spans it still has
+        self.dirty_poles = set()
+        # Spans added or renumbered since the last reload, marked once the
+        # arrays are rebuilt
+        self.pending_fids = set()
+        self.needs_reload = False
+        self._flush_scheduled = False
+
+        # Start from a full, consistent state
+        write_line_angles(layer, angle_field_name, dead_band)
+        self.angle_field_index = layer.fields().indexFromName(angle_field_name)
+        self.reload()
+
+        layer.geometryChanged.connect(self.on_geometry_changed)
+        layer.attributeValueChanged.connect(self.on_attribute_changed)
+        layer.featureAdded.connect(self.on_feature_added)
+        layer.featureDeleted.connect(self.on_feature_deleted)
+
+    def disconnect(self):
+        self.layer.geometryChanged.disconnect(self.on_geometry_changed)
+        self.layer.attributeValueChanged.disconnect(self.on_attribute_changed)
+        self.layer.featureAdded.disconnect(self.on_feature_added)
+        self.layer.featureDeleted.disconnect(self.on_feature_deleted)
+
+    def reload(self):
+        # Rebuild the arrays and lookups; only needed when spans are added,
+        # deleted or renumbered, not when a pole is moved
+        self.spans = read_spans(self.layer)
+        self.row_of = {int(fid): row for row,
+                       fid in enumerate(self.spans['fids'])}
+        self.rows_of_span = {}
+        self.rows_of_pole = {}
+        for row, (span_number, pole_number) in enumerate(zip(self.spans['span_numbers'], self.spans['pole_numbers'])):
+            self.rows_of_span.setdefault(span_number, []).append(row)
+            self.rows_of_pole.setdefault(pole_number, []).append(row)
+        self.needs_reload = False
+
+    def mark_row(self, row):
+        # The span (and the span before it) and its pole, as currently loaded
+        span_number = self.spans['span_numbers'][row]
+        self.dirty_spans.update((span_number - 1, span_number))
+        self.dirty_poles.add(self.spans['pole_numbers'][row])
+
+    def mark(self, fid):
+        row = self.row_of.get(fid)
+        if row is None:
+            return
+        self.mark_row(row)
+        self.schedule_flush()
+
+    def mark_after_reload(self, fid):
+        # The loaded values are stale: a full reload happens once, in the next flush
+        self.needs_reload = True
+        self.pending_fids.add(fid)
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        if not self.auto_flush or self._flush_scheduled:
+            return
+        self._flush_scheduled = True
+        # Coalesce a burst of edits into one recomputation
+        QTimer.singleShot(0, self.flush)
+
+    def on_geometry_changed(self, fid, geometry):
+        row = self.row_of.get(fid)
+        if self.needs_reload or row is None:
+            self.mark_after_reload(fid)
+            return
+        ends = line_ends(geometry)
+        if ends is None:
+            self.mark_after_reload(fid)
+            return
+        start, end = ends
+        self.spans['starts'][row] = start.x(), start.y()
+        self.spans['ends'][row] = end.x(), end.y()
+        self.mark(fid)
+
+    def on_attribute_changed(self, fid, field_index, value):
+        if field_index == self.angle_field_index:
+            # Our own writes
+            return
+        if self.layer.fields().at(field_index).name() not in self.tracked_fields:
+            return
+        # The old span number and pole, then the new ones after the reload
+        self.mark(fid)
+        self.mark_after_reload(fid)
+
+    def on_feature_added(self, fid):
+        self.mark_after_reload(fid)
+
+    def on_feature_deleted(self, fid):
+        self.mark(fid)
+        self.pending_fids.discard(fid)
+        self.needs_reload = True
+        self.schedule_flush()
+
+    def row_angle(self, row):
+        span_number = self.spans['span_numbers'][row]
+        next_rows = self.rows_of_span.get(span_number + 1)
+        if not next_rows:
+            return 0.0
+        next_row = next_rows[0]
+        return span_angles(self.spans['starts'][[row, next_row]], self.spans['ends'][[row, next_row]],
+                           [span_number, span_number + 1], self.dead_band)[0]
+
+    def flush(self):
+        self._flush_scheduled = False
+        if self.needs_reload:
+            # One full read for the whole burst of edits
+            self.reload()
+            for fid in self.pending_fids:
+                if fid in self.row_of:
+                    self.mark_row(self.row_of[fid])
+        self.pending_fids.clear()
+        if not self.dirty_spans and not self.dirty_poles:
+            return {}
+        rows = [row for span_number in self.dirty_spans
+                for row in self.rows_of_span.get(span_number, [])]
+        pole_numbers = self.dirty_poles | {self.spans['pole_numbers'][row] for row in rows}
+        self.dirty_spans.clear()
+        self.dirty_poles.clear()
+
+        # Every pole touched by a dirty span gets the label of its first
+        # non-deadend span again, and all its spans are rewritten
+        updates = {}
+        for pole_number in pole_numbers:
+            pole_rows = self.rows_of_pole.get(pole_number, [])
+            eligible = [row for row in pole_rows
+                        if self.spans['branch_ids'][row] != 'deadend']
+            label = str(angle_labels(np.array([self.row_angle(eligible[0])]))[
+                        0]) if eligible else 'deadend'
+            for row in pole_rows:
+                updates[int(self.spans['fids'][row])] = label
+
+        if self.layer.isEditable():
+            for fid, label in updates.items():
+                self.layer.changeAttributeValue(
+                    fid, self.angle_field_index, label)
+        else:
+            self.layer.dataProvider().changeAttributeValues(
+                {fid: {self.angle_field_index: label} for fid, label in updates.items()})
+        return updates
@@ -0,0 +1,32 @@
+from qgis.core import QgsProject
+import os
+
+from expression_library import MaterializedExpressions, load_expression_library
+from instrumentation import run_report
+
+layer_name = 'lv_poles'
+library_file = 'write_enclosures.json'
+# Expression name in the library -> field the result is stored in
+fields = {'pole_label.html': 'pole_label'}
+# True keeps the columns in step with edits: edited features are re-evaluated
+# on the next materialized_expressions.write(fields) instead of the whole layer
+keep_watching = False
+# Path of the JSON run report, None only logs the stage summaries
+report_path = None
+
+layer = QgsProject.instance().mapLayersByName(layer_name)[0]
+library = load_expression_library(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), library_file)
+    if '__file__' in globals() else library_file)
+
+with run_report('materialize_expressions', report_path):
+    # Each expression runs once per feature in a single pass, with get_feature
+    # lookups served from one table per layer
+    materialized_expressions = MaterializedExpressions(
+        layer, {name: library[name] for name in fields})
+    materialized_expressions.write(fields)
+
+if not keep_watching:
+    materialized_expressions.disconnect()
+layer.triggerRepaint()
+print(f'Materialized {", ".join(fields.values())} on {layer_name}')
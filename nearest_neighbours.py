@@ -0,0 +1,86 @@
+import numpy as np
+from qgis.core import (QgsFeature, QgsField, QgsGeometry, QgsPointXY, QgsRectangle,
+                       QgsSpatialIndex, QgsVectorLayer)
+from qgis.PyQt.QtCore import QVariant
+
+from instrumentation import stage
+from structure_counts import layer_points, project_to_metres
+
+
+def projected_index(fids, coords):
+    # Spatial index over already projected points, keyed by feature id
+    index = QgsSpatialIndex()
+    for fid, (x, y) in zip(fids, coords):
+        index.addFeature(int(fid), QgsRectangle(x, y, x, y))
+    return index
+
+
+def nearest_neighbours(fids, coords, max_distance=300, later_only=True, neighbours=8):
+    # (fid, neighbour fid, distance) for the nearest point of every point within
+    # max_distance metres. coords are projected. With later_only only points with
+    # a higher feature id are candidates, so every pair comes out once; otherwise
+    # the nearest point overall is used and mutual pairs are dropped.
+    fids = np.asarray(fids, dtype=np.int64)
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    index = projected_index(fids, coords)
+    row_of = {int(fid): row for row, fid in enumerate(fids)}
+
+    pairs = []
+    drawn_pairs = set()
+    for row, fid in enumerate(fids):
+        fid = int(fid)
+        point = QgsPointXY(*coords[row])
+        # Ask for more candidates only when all of the closest ones are ruled out
+        wanted = neighbours
+        while True:
+            found = index.nearestNeighbor(point, wanted, max_distance)
+            candidates = [candidate for candidate in found
+                          if candidate > fid or (not later_only and candidate != fid)]
+            if candidates or len(found) < wanted:
+                break
+            wanted *= 2
+        if not candidates:
+            continue
+
+        candidate_rows = np.array([row_of[candidate] for candidate in candidates])
+        distances = np.hypot(*(coords[candidate_rows] - coords[row]).T)
+        nearest = int(np.argmin(distances))
+        if distances[nearest] > max_distance:
+            continue
+        pair = tuple(sorted((fid, candidates[nearest])))
+        if pair in drawn_pairs:
+            continue
+        drawn_pairs.add(pair)
+        pairs.append((fid, candidates[nearest], float(distances[nearest])))
+    return pairs
+
+
+def nearest_neighbour_lines(layer, name, max_distance=300, later_only=True):
+    # Line from every point to its nearest neighbour, with the distance in metres,
+    # in the CRS of the point layer
+    with stage('read') as record:
+        fids, points = layer_points(layer)
+        record['features'] = len(fids)
+    with stage('project', len(fids)):
+        projected, _ = project_to_metres(points, layer.crs())
+    with stage('nearest_neighbours', len(fids)):
+        pairs = nearest_neighbours(fids, projected, max_distance, later_only)
+
+    line_layer = QgsVectorLayer(
+        "LineString?crs=" + layer.crs().authid(), name, "memory")
+    provider = line_layer.dataProvider()
+    provider.addAttributes([QgsField("distance", QVariant.Double)])
+    line_layer.updateFields()
+
+    with stage('write', len(pairs)):
+        row_of = {int(fid): row for row, fid in enumerate(fids)}
+        line_features = []
+        for fid, neighbour_fid, distance in pairs:
+            line_feature = QgsFeature(line_layer.fields())
+            line_feature.setGeometry(QgsGeometry.fromPolylineXY(
+                [QgsPointXY(*points[row_of[fid]]), QgsPointXY(*points[row_of[neighbour_fid]])]))
+            line_feature.setAttributes([distance])
+            line_features.append(line_feature)
+        provider.addFeatures(line_features)
+        line_layer.updateExtents()
+    return line_layer
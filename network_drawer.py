@@ -0,0 +1,399 @@
+import os
+import tempfile
+
+import numpy as np
+from qgis.core import (QgsCoordinateReferenceSystem, QgsFields, QgsField, QgsFeature, QgsGeometry,
+                       QgsPointXY, QgsPoint, QgsProject, QgsVectorFileWriter, QgsVectorLayer,
+                       QgsWkbTypes)
+
+from PyQt5.QtCore import QVariant
+
+from control_pole_index import ControlPoleIndex
+from densify import interpolate_spans
+from drawing_profiles import PROFILES
+from instrumentation import count, debug_enabled, log, run_report, stage
+from pole_numbering import format_pole_number, resolve_width
+from span_lengths import segment_lengths
+from span_planner import SPAN_TABLE, plan_branches, span_limits
+from transform_service import TransformService, as_coords, shared_transform_service
+
+
+class DrawingContext:
+    # Layers, control pole indexes, projected branches and transforms shared by
+    # every profile drawn in the same run
+
+    def __init__(self, project=None):
+        self.project = project or QgsProject.instance()
+        if project is None:
+            self.transforms = shared_transform_service()
+        else:
+            self.transforms = TransformService(project)
+        self.layers = {}
+        self.indexes = {}
+        self.branch_geometries = {}
+
+    def layer(self, layer_name):
+        if layer_name not in self.layers:
+            layers = self.project.mapLayersByName(layer_name)
+            if not layers:
+                raise ValueError(f'Layer {layer_name} not found')
+            self.layers[layer_name] = layers[0]
+        return self.layers[layer_name]
+
+    def index(self, layer_name):
+        if layer_name not in self.indexes:
+            cp_index = ControlPoleIndex(self.layer(layer_name))
+            cp_index.report_missing_parents()
+            self.indexes[layer_name] = cp_index
+        return self.indexes[layer_name]
+
+    def control_pole_metres(self, layer_name):
+        # control_pole -> (x, y) of every control pole in the UTM zone of the root
+        cp_index = self.index(layer_name)
+        source_crs = self.layer(layer_name).sourceCrs()
+        points = [cp_index.point(control_pole) for control_pole in cp_index.order]
+        if not points:
+            return {}
+        epsg = self.transforms.utm_epsg_codes(points[:1], source_crs)[0]
+        metres = self.transforms.to_utm(points, source_crs, epsg)
+        return dict(zip(cp_index.order, map(tuple, metres)))
+
+    def branch_geometry(self, layer_name, branches=None):
+        # Branch end points projected to UTM plus their ellipsoidal lengths.
+        # Both ends of a branch use the UTM zone of its control pole.
+        # Only the layer's own branches are cached, planned branch lists are not.
+        if branches is None and layer_name in self.branch_geometries:
+            return self.branch_geometries[layer_name]
+        cp_index = self.index(layer_name)
+        source_crs = self.layer(layer_name).sourceCrs()
+        cached = branches is None
+        if cached:
+            branches = list(cp_index.branches())
+        feature_points = [cp_index.point(control_pole)
+                          for control_pole, _ in branches]
+        connecting_cp_points = [cp_index.point(cp_number)
+                                for _, cp_number in branches]
+        utm_codes = self.transforms.utm_epsg_codes(
+            feature_points, source_crs)
+        geometry = {
+            'source_crs': source_crs,
+            'branches': branches,
+            'feature_points': feature_points,
+            'connecting_cp_points': connecting_cp_points,
+            'utm_codes': utm_codes,
+            'features_utm': self.transforms.to_utm(feature_points, source_crs, utm_codes),
+            'connecting_cps_utm': self.transforms.to_utm(connecting_cp_points, source_crs, utm_codes),
+            'total_distances': self.transforms.distances(feature_points, connecting_cp_points, source_crs),
+        }
+        if cached:
+            self.branch_geometries[layer_name] = geometry
+        return geometry
+
+
+def resolve_profile(profile):
+    if isinstance(profile, str):
+        if profile not in PROFILES:
+            raise ValueError(f'Unknown drawing profile {profile}')
+        return PROFILES[profile]
+    return profile
+
+
+def network_fields(profile):
+    fields = QgsFields()
+    fields.append(QgsField('pole_number', QVariant.String))
+    fields.append(QgsField('number_of_connections', QVariant.Int))
+    fields.append(QgsField('back_span', QVariant.Double))
+    fields.append(QgsField('branch_id', QVariant.String))
+    for field_name in profile.get('copy_fields', []):
+        fields.append(QgsField(field_name, QVariant.String))
+    return fields
+
+
+def write_network(profile, context, cp_index, geometry, counts, point_layer, line_layer, fields):
+    # Every pole and span is built in memory and written in one go
+    prefix = profile['prefix']
+    copy_fields = profile.get('copy_fields', [])
+    branches = geometry['branches']
+
+    # Place the intermediate poles of all branches in one pass and project them back
+    with stage('densify') as record:
+        poles_utm, offsets = interpolate_spans(
+            geometry['connecting_cps_utm'], geometry['features_utm'], counts)
+        span_lengths = np.asarray(geometry['total_distances'], dtype=float) / counts
+        poles_src = context.transforms.from_utm(
+            poles_utm, np.repeat(geometry['utm_codes'], np.diff(offsets)), geometry['source_crs'])
+        # The last pole of every branch is the control pole itself
+        poles_src[offsets[1:] - 1] = as_coords(geometry['feature_points'])
+        record['features'] = len(poles_src)
+
+    # Numbers follow generation order: the root pole (if any) is 1 and the n-th
+    # branch pole n + 1, so every label is final when its pole is built
+    has_root = cp_index.root is not None
+    first_pole = 1 if has_root else 0
+    width = resolve_width(profile.get('pole_number_width', 2), first_pole + len(poles_src))
+    labels = [format_pole_number(prefix, pole_index + 2, width)
+              for pole_index in range(len(poles_src))]
+
+    with stage('build_poles') as record:
+        pointFeatures = []
+        if has_root:
+            # create a new point feature from the first control pole
+            new_feature = QgsFeature(fields)
+            new_feature.setGeometry(
+                QgsGeometry.fromPointXY(cp_index.point(cp_index.root)))
+            new_feature.setAttribute('pole_number', format_pole_number(prefix, 1, width))
+            pointFeatures.append(new_feature)
+
+        branch_copied = []
+        for branch_index, (control_pole, cp_number) in enumerate(branches):
+            attributes = cp_index.attributes(control_pole)
+            copied = {field_name: attributes.get(field_name)
+                      for field_name in copy_fields}
+            branch_copied.append(copied)
+            for pole_index in range(offsets[branch_index], offsets[branch_index + 1]):
+                x, y = poles_src[pole_index]
+                pointFeature = QgsFeature(fields)
+                pointFeature.setGeometry(
+                    QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+                pointFeature.setAttribute('pole_number', labels[pole_index])
+                for field_name, value in copied.items():
+                    pointFeature.setAttribute(field_name, value)
+                pointFeatures.append(pointFeature)
+        record['features'] = len(pointFeatures)
+
+    # Geodesic length of every span, from the previous pole (the connecting
+    # control pole for the first span of a branch) to its end pole
+    with stage('span_lengths', len(poles_src)):
+        span_starts = np.empty_like(poles_src)
+        span_starts[1:] = poles_src[:-1]
+        span_starts[offsets[:-1]] = as_coords(geometry['connecting_cp_points'])
+        back_spans = np.round(segment_lengths(
+            span_starts, poles_src, geometry['source_crs'], context.transforms), 2)
+
+    # Walk every span in branch order: the span takes the number of its end pole
+    with stage('build_spans') as record:
+        lineFeatures = []
+        verbose = debug_enabled()
+        for branch_index, (control_pole, cp_number) in enumerate(branches):
+            branch_id = f'{control_pole} - {cp_number}'
+            start_point = geometry['connecting_cp_points'][branch_index]
+            previous = QgsPoint(start_point.x(), start_point.y())
+            if verbose:
+                log.debug(
+                    f'{branch_id}: {offsets[branch_index + 1] - offsets[branch_index]} spans of {span_lengths[branch_index]:.1f}m')
+            for pole_index in range(offsets[branch_index], offsets[branch_index + 1]):
+                x, y = poles_src[pole_index]
+                point = QgsPoint(x, y)
+                lineFeature = QgsFeature(fields)
+                lineFeature.setGeometry(
+                    QgsGeometry.fromPolyline([previous, point]))
+                lineFeature.setAttribute('branch_id', branch_id)
+                lineFeature.setAttribute('pole_number', labels[pole_index])
+                lineFeature.setAttribute(
+                    'back_span', float(back_spans[pole_index]))
+                pointFeatures[first_pole + pole_index].setAttribute(
+                    'back_span', float(back_spans[pole_index]))
+                for field_name, value in branch_copied[branch_index].items():
+                    lineFeature.setAttribute(field_name, value)
+                lineFeatures.append(lineFeature)
+                previous = point
+        record['features'] = len(lineFeatures)
+
+    with stage('write', len(pointFeatures) + len(lineFeatures)):
+        point_layer.dataProvider().addFeatures(pointFeatures)
+        line_layer.dataProvider().addFeatures(lineFeatures)
+
+
+def branch_chunks(counts, chunk_size):
+    # (first, last, first_pole) of consecutive branch slices holding about
+    # chunk_size poles each. A branch is never split, so one long branch can
+    # make its chunk larger.
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    first = 0
+    while first < len(counts):
+        last = int(np.searchsorted(offsets, offsets[first] + chunk_size, side='right')) - 1
+        last = max(last, first + 1)
+        yield first, last, int(offsets[first])
+        first = last
+
+
+def geopackage_layer(path, layer_name, geometry_type, fields, context):
+    # Empty GeoPackage table opened on the ogr provider, so every addFeatures
+    # goes straight to disk instead of piling up in a memory layer
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = 'GPKG'
+    options.layerName = layer_name
+    if os.path.exists(path):
+        options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+    writer = QgsVectorFileWriter.create(
+        path, fields, geometry_type, QgsCoordinateReferenceSystem('EPSG:4326'),
+        context.project.transformContext(), options)
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise RuntimeError(
+            f'Could not create {layer_name} in {path}: {writer.errorMessage()}')
+    # Deleting the writer closes the file
+    del writer
+    layer = QgsVectorLayer(f'{path}|layername={layer_name}', layer_name, 'ogr')
+    if not layer.isValid():
+        raise RuntimeError(f'Could not open {layer_name} in {path}')
+    return layer
+
+
+def stream_network(profile, context, cp_index, geometry, counts, point_layer, line_layer, chunk_size):
+    # Poles and spans are generated chunk_size poles at a time and flushed to the
+    # file-backed layers. Numbers follow branch order (the root is 1, the n-th
+    # generated pole n + 1), so every label is final when its pole is built and
+    # only the running pole count is carried from one chunk to the next.
+    prefix = profile['prefix']
+    copy_fields = profile.get('copy_fields', [])
+    branches = geometry['branches']
+    has_root = cp_index.root is not None
+    width = resolve_width(profile.get('pole_number_width', 2),
+                          int(has_root) + int(np.sum(counts)))
+    # GeoPackage layers put an fid field first, so features use the layer's fields
+    point_fields, line_fields = point_layer.fields(), line_layer.fields()
+    point_provider = point_layer.dataProvider()
+    line_provider = line_layer.dataProvider()
+    verbose = debug_enabled()
+
+    with stage('stream') as record:
+        written_points = written_lines = 0
+        if has_root:
+            root_feature = QgsFeature(point_fields)
+            root_feature.setGeometry(
+                QgsGeometry.fromPointXY(cp_index.point(cp_index.root)))
+            root_feature.setAttribute('pole_number', format_pole_number(prefix, 1, width))
+            point_provider.addFeatures([root_feature])
+            written_points += 1
+
+        for first, last, first_pole in branch_chunks(counts, chunk_size):
+            count('chunk')
+            chunk_counts = counts[first:last]
+            poles_utm, offsets = interpolate_spans(
+                geometry['connecting_cps_utm'][first:last], geometry['features_utm'][first:last], chunk_counts)
+            poles_src = context.transforms.from_utm(
+                poles_utm, np.repeat(geometry['utm_codes'][first:last], chunk_counts), geometry['source_crs'])
+            poles_src[offsets[1:] - 1] = as_coords(geometry['feature_points'][first:last])
+
+            span_starts = np.empty_like(poles_src)
+            span_starts[1:] = poles_src[:-1]
+            span_starts[offsets[:-1]] = as_coords(geometry['connecting_cp_points'][first:last])
+            back_spans = np.round(segment_lengths(
+                span_starts, poles_src, geometry['source_crs'], context.transforms), 2)
+
+            pointFeatures, lineFeatures = [], []
+            for branch_index in range(first, last):
+                control_pole, cp_number = branches[branch_index]
+                branch_id = f'{control_pole} - {cp_number}'
+                attributes = cp_index.attributes(control_pole)
+                copied = {field_name: attributes.get(field_name)
+                          for field_name in copy_fields}
+                start_point = geometry['connecting_cp_points'][branch_index]
+                previous = QgsPoint(start_point.x(), start_point.y())
+                start, end = offsets[branch_index - first], offsets[branch_index - first + 1]
+                if verbose:
+                    log.debug(
+                        f'{branch_id}: {end - start} spans of {geometry["total_distances"][branch_index] / (end - start):.1f}m')
+                for pole_index in range(start, end):
+                    x, y = poles_src[pole_index]
+                    point = QgsPoint(x, y)
+                    label = format_pole_number(prefix, first_pole + pole_index + 2, width)
+                    back_span = float(back_spans[pole_index])
+
+                    pointFeature = QgsFeature(point_fields)
+                    pointFeature.setGeometry(
+                        QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+                    pointFeature.setAttribute('pole_number', label)
+                    pointFeature.setAttribute('back_span', back_span)
+                    lineFeature = QgsFeature(line_fields)
+                    lineFeature.setGeometry(
+                        QgsGeometry.fromPolyline([previous, point]))
+                    lineFeature.setAttribute('branch_id', branch_id)
+                    lineFeature.setAttribute('pole_number', label)
+                    lineFeature.setAttribute('back_span', back_span)
+                    for field_name, value in copied.items():
+                        pointFeature.setAttribute(field_name, value)
+                        lineFeature.setAttribute(field_name, value)
+                    pointFeatures.append(pointFeature)
+                    lineFeatures.append(lineFeature)
+                    previous = point
+
+            point_provider.addFeatures(pointFeatures)
+            line_provider.addFeatures(lineFeatures)
+            written_points += len(pointFeatures)
+            written_lines += len(lineFeatures)
+        record['features'] = written_points + written_lines
+
+
+def draw_network(profile, context=None, add_to_project=True, chunk_size=None, output_path=None):
+    # chunk_size (or the profile's chunk_size) streams the network that many
+    # poles at a time into GeoPackage layers at output_path (or the profile's
+    # output_path, networks.gpkg next to the project by default) instead of
+    # building it all in memory layers
+    profile = resolve_profile(profile)
+    context = context or DrawingContext()
+    chunk_size = chunk_size or profile.get('chunk_size')
+
+    with stage('index') as record:
+        cp_index = context.index(profile['control_poles'])
+        record['features'] = len(cp_index)
+    with stage('project_branches') as record:
+        if profile.get('drop_straight_control_poles'):
+            # Straight runs are planned as a whole, dropped control poles get no pole
+            planned, dropped = plan_branches(
+                cp_index, context.control_pole_metres(profile['control_poles']), profile)
+            geometry = context.branch_geometry(profile['control_poles'], planned)
+            record['dropped'] = len(dropped)
+        else:
+            geometry = context.branch_geometry(profile['control_poles'])
+        branches = geometry['branches']
+        record['features'] = len(branches)
+
+    with stage('plan_spans', len(branches)):
+        total_distances = np.asarray(geometry['total_distances'], dtype=float)
+        min_spans, max_spans = span_limits(profile, branches, total_distances)
+        counts = SPAN_TABLE.counts(total_distances, min_spans, max_spans)
+
+    fields = network_fields(profile)
+    if chunk_size:
+        output_path = output_path or profile.get('output_path') or os.path.join(
+            context.project.homePath() or tempfile.gettempdir(), 'networks.gpkg')
+        point_layer = geopackage_layer(
+            output_path, profile['point_layer'], QgsWkbTypes.Point, fields, context)
+        line_layer = geopackage_layer(
+            output_path, profile['line_layer'], QgsWkbTypes.LineString, fields, context)
+        stream_network(profile, context, cp_index, geometry, counts,
+                       point_layer, line_layer, chunk_size)
+        point_layer.updateExtents()
+        line_layer.updateExtents()
+    else:
+        point_layer = QgsVectorLayer(
+            'Point?crs=EPSG:4326', profile['point_layer'], 'memory')
+        line_layer = QgsVectorLayer(
+            'LineString?crs=epsg:4326', profile['line_layer'], 'memory')
+        point_layer.dataProvider().addAttributes(fields)
+        point_layer.updateFields()
+        line_layer.dataProvider().addAttributes(fields)
+        line_layer.updateFields()
+        write_network(profile, context, cp_index, geometry, counts,
+                      point_layer, line_layer, fields)
+
+    if add_to_project:
+        context.project.addMapLayer(point_layer)
+        context.project.addMapLayer(line_layer)
+    return point_layer, line_layer
+
+
+def draw_networks(profiles, context=None, add_to_project=True, report_path=None, chunk_size=None,
+                  output_path=None):
+    # Draw several networks (e.g. MV and LV of several minigrids) in one run,
+    # sharing the loaded layers, indexes and transform caches
+    context = context or DrawingContext()
+    results = []
+    with run_report('draw_networks', report_path):
+        for profile in profiles:
+            name = profile if isinstance(profile, str) else profile['point_layer']
+            with stage(name):
+                results.append(draw_network(profile, context, add_to_project, chunk_size, output_path))
+    return results
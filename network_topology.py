@@ -0,0 +1,132 @@
+import numpy as np
+from qgis.core import (QgsFeature, QgsField, QgsGeometry, QgsMultiPoint, QgsPoint,
+                       QgsPointXY, QgsVectorLayer)
+from qgis.PyQt.QtCore import QVariant
+
+from instrumentation import count, stage
+from nearest_neighbours import projected_index
+from structure_counts import layer_points, project_to_metres
+
+
+def delaunay_edges(coords):
+    # (i, j) row pairs of the Delaunay triangulation edges of projected points.
+    # Coincident points are all joined to the first of them.
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    row_of = {}
+    edges = []
+    for row, (x, y) in enumerate(coords):
+        first = row_of.setdefault((x, y), row)
+        if first != row:
+            edges.append((first, row))
+    if len(row_of) < 3:
+        rows = list(row_of.values())
+        return edges + list(zip(rows, rows[1:]))
+
+    multi_point = QgsMultiPoint()
+    for x, y in row_of:
+        multi_point.addGeometry(QgsPoint(x, y))
+    triangulation = QgsGeometry(multi_point).delaunayTriangulation(0, True)
+    count('delaunayTriangulation')
+    lines = triangulation.asMultiPolyline()
+    if not lines:
+        # Collinear points (a single straight feeder) have no triangulation:
+        # join them one after the other along the line
+        rows = np.array(list(row_of.values()))
+        offsets = coords[rows] - coords[rows[0]]
+        direction = offsets[np.argmax(np.hypot(*offsets.T))]
+        order = rows[np.argsort(offsets @ direction, kind='stable')].tolist()
+        return edges + list(zip(order, order[1:]))
+    for line in lines:
+        start, end = line[0], line[-1]
+        edges.append((row_of[(start.x(), start.y())], row_of[(end.x(), end.y())]))
+    return edges
+
+
+def knn_edges(coords, neighbours=8):
+    # (i, j) row pairs linking every projected point to its k nearest points
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    index = projected_index(range(len(coords)), coords)
+    edges = set()
+    for row, (x, y) in enumerate(coords):
+        for other in index.nearestNeighbor(QgsPointXY(x, y), neighbours + 1):
+            if other != row:
+                edges.add((min(row, other), max(row, other)))
+    return sorted(edges)
+
+
+def minimum_spanning_tree(coords, edges, max_span=None, max_degree=None):
+    # Kruskal over the candidate edges with a union-find. Edges longer than
+    # max_span are never used and a point never gets more than max_degree
+    # lines, so the result can be a forest. Returns (i, j, distance) rows.
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    distances = np.hypot(*(coords[edges[:, 0]] - coords[edges[:, 1]]).T)
+    if max_span is not None:
+        keep = distances <= max_span
+        edges, distances = edges[keep], distances[keep]
+    order = np.argsort(distances, kind='stable')
+
+    parent = list(range(len(coords)))
+    degree = [0] * len(coords)
+
+    def find(row):
+        while parent[row] != row:
+            parent[row] = parent[parent[row]]
+            row = parent[row]
+        return row
+
+    tree = []
+    for edge_index in order:
+        i, j = int(edges[edge_index, 0]), int(edges[edge_index, 1])
+        if max_degree is not None and (degree[i] >= max_degree or degree[j] >= max_degree):
+            continue
+        root_i, root_j = find(i), find(j)
+        if root_i == root_j:
+            continue
+        parent[root_i] = root_j
+        degree[i] += 1
+        degree[j] += 1
+        tree.append((i, j, float(distances[edge_index])))
+        if len(tree) == len(coords) - 1:
+            break
+    return tree
+
+
+def topology_lines(layer, name, candidates='delaunay', neighbours=8, max_span=None, max_degree=None):
+    # Minimum spanning network over a point layer, as a line layer with the
+    # span length in metres and the feature ids of both ends
+    with stage('read') as record:
+        fids, points = layer_points(layer)
+        record['features'] = len(fids)
+    with stage('project', len(fids)):
+        projected, _ = project_to_metres(points, layer.crs())
+    with stage('candidate_edges', len(fids)) as record:
+        if candidates == 'delaunay':
+            edges = delaunay_edges(projected)
+        elif candidates == 'knn':
+            edges = knn_edges(projected, neighbours)
+        else:
+            raise ValueError(f'Unknown candidate graph: {candidates}')
+        record['edges'] = len(edges)
+    with stage('spanning_tree', len(edges)):
+        tree = minimum_spanning_tree(projected, edges, max_span, max_degree)
+
+    line_layer = QgsVectorLayer(
+        "LineString?crs=" + layer.crs().authid(), name, "memory")
+    provider = line_layer.dataProvider()
+    provider.addAttributes([QgsField("distance", QVariant.Double),
+                            QgsField("from_fid", QVariant.LongLong),
+                            QgsField("to_fid", QVariant.LongLong)])
+    line_layer.updateFields()
+
+    with stage('write', len(tree)):
+        line_features = []
+        for i, j, distance in tree:
+            line_feature = QgsFeature(line_layer.fields())
+            line_feature.setGeometry(QgsGeometry.fromPolylineXY(
+                [QgsPointXY(*points[i]), QgsPointXY(*points[j])]))
+            line_feature.setAttributes([distance, int(fids[i]), int(fids[j])])
+            line_features.append(line_feature)
+        provider.addFeatures(line_features)
+        line_layer.updateExtents()
+    return line_layer
@@ -0,0 +1,26 @@
+from qgis.core import QgsProject
+
+from instrumentation import run_report
+from network_topology import topology_lines
+
+# Replace with the name of your point layer
+layer_name = "poles_nimba_county"
+# 'delaunay' uses the triangulation edges as candidate spans, 'knn' the k nearest poles
+candidates = 'delaunay'
+neighbours = 8
+# Longest span (metres) the network may use, None for no limit
+max_span = 300
+# Most lines allowed at one pole, None for no limit
+max_degree = None
+# Path of the JSON run report, None only logs the stage summaries
+report_path = None
+
+layer = QgsProject.instance().mapLayersByName(layer_name)[0]
+
+# Connects every pole into one minimum spanning network (or one per island
+# when max_span cuts it), without duplicate pairs
+with run_report('network_topology', report_path):
+    line_layer = topology_lines(
+        layer, "topology_nimba_county", candidates, neighbours, max_span, max_degree)
+
+QgsProject.instance().addMapLayer(line_layer)
@@ -0,0 +1,87 @@
+import numpy as np
+from qgis.core import QgsFeature, QgsFeatureRequest, QgsGeometry, QgsPointXY
+
+from densify import interpolate_spans
+from instrumentation import count, log, stage
+from pole_numbering import format_pole_number
+from transform_service import shared_transform_service
+
+
+def parse_pole_number(pole_number):
+    # 'M012' -> 12; None when the pole has no usable number
+    try:
+        return int(pole_number[1:])
+    except (TypeError, ValueError):
+        return None
+
+
+def ordered_poles(layer, pole_number_field='pole_number'):
+    # Point coordinates and parsed pole numbers of a layer, sorted by pole number
+    request = QgsFeatureRequest().setSubsetOfAttributes(
+        [pole_number_field], layer.fields())
+    numbers, points, unnumbered = [], [], []
+    count('getFeatures')
+    for feature in layer.getFeatures(request):
+        number = parse_pole_number(feature[pole_number_field])
+        if number is None or feature.geometry().isNull():
+            unnumbered.append(feature.id())
+            continue
+        point = feature.geometry().asPoint()
+        numbers.append(number)
+        points.append((point.x(), point.y()))
+    if unnumbered:
+        log.warning(
+            f'{len(unnumbered)} poles without a valid {pole_number_field} ignored: {unnumbered}')
+
+    numbers = np.array(numbers, dtype=np.int64)
+    order = np.argsort(numbers, kind='stable')
+    return numbers[order], np.array(points, dtype=float).reshape(-1, 2)[order]
+
+
+def infill_poles(layer, prefix='M', width=3, attributes=None, transforms=None):
+    # Evenly spaced poles in every gap of the pole numbering (e.g. M004 -> M007
+    # gets M005 and M006), placed on the straight line between the two numbered
+    # poles in the UTM zone of the first one. Returns the new features, with
+    # back_span set to the span length of their gap and attributes copied in.
+    transforms = transforms or shared_transform_service()
+    source_crs = layer.sourceCrs()
+
+    with stage('read') as record:
+        numbers, points = ordered_poles(layer)
+        record['features'] = len(numbers)
+
+    with stage('compute_infill') as record:
+        gaps = np.diff(numbers) - 1
+        has_gap = np.flatnonzero(gaps > 0)
+        starts, ends = points[has_gap], points[has_gap + 1]
+        gaps = gaps[has_gap]
+
+        utm_codes = transforms.utm_epsg_codes(starts, source_crs)
+        starts_utm = transforms.to_utm(starts, source_crs, utm_codes)
+        ends_utm = transforms.to_utm(ends, source_crs, utm_codes)
+        # gaps + 1 spans per gap; the last interpolated point of each gap is the
+        # existing end pole and is dropped
+        coords, offsets = interpolate_spans(starts_utm, ends_utm, gaps + 1)
+        is_new = np.ones(len(coords), dtype=bool)
+        is_new[offsets[1:] - 1] = False
+        gap_index = np.repeat(np.arange(len(gaps)), gaps + 1)[is_new]
+        coords = transforms.from_utm(
+            coords[is_new], utm_codes[gap_index], source_crs)
+
+        back_spans = transforms.distances(starts, ends, source_crs) / (gaps + 1)
+        first_new = np.repeat(offsets[:-1] - np.arange(len(gaps)), gaps)
+        new_numbers = numbers[has_gap][gap_index] + \
+            np.arange(len(coords)) - first_new + 1
+        record['features'] = len(coords)
+
+    point_features = []
+    for (x, y), number, back_span in zip(coords, new_numbers, back_spans[gap_index]):
+        point_feature = QgsFeature(layer.fields())
+        point_feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+        point_feature.setAttribute(
+            'pole_number', format_pole_number(prefix, number, width))
+        for field_name, value in (attributes or {}).items():
+            point_feature.setAttribute(field_name, value)
+        point_feature.setAttribute('back_span', float(back_span))
+        point_features.append(point_feature)
+    return point_features
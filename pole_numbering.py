@@ -0,0 +1,13 @@
+def pole_number_width(count: int, min_width=2):
+    # Zero-padding wide enough for count poles, never narrower than P01/LV01
+    return max(min_width, len(str(max(count, 1))))
+
+
+def resolve_width(width, count: int):
+    # A fixed width, or 'auto' to pad wide enough for count poles
+    return pole_number_width(count) if width == 'auto' else width
+
+
+def format_pole_number(prefix: str, number: int, width=2):
+    return f'{prefix}{int(number):0{width}d}'
+
@@ -0,0 +1,90 @@
+from qgis.core import (QgsFeature, QgsFeatureRequest, QgsGeometry, QgsMultiPoint, QgsPoint, QgsPointXY,
+                       QgsRectangle, QgsSpatialIndex, QgsVectorLayer)
+
+from instrumentation import count, stage
+from structure_counts import layer_points, project_to_metres
+from transform_service import shared_transform_service
+
+
+def service_area_geometries(points, radius, segments=8):
+    # Voronoi cell of every projected point clipped to the point's own buffer,
+    # in metres. Anything in a cell is closer to its pole than to any other, so
+    # this equals clipping all cells against the union of all buffers.
+    # Coincident points share one cell.
+    row_of = {}
+    for row, (x, y) in enumerate(points):
+        row_of.setdefault((x, y), row)
+    buffers = {row: QgsGeometry.fromPointXY(QgsPointXY(x, y)).buffer(radius, segments)
+               for (x, y), row in row_of.items()}
+    if len(row_of) < 2:
+        return [buffers[row_of[(x, y)]] for x, y in points]
+
+    multi_point = QgsMultiPoint()
+    index = QgsSpatialIndex()
+    for (x, y), row in row_of.items():
+        multi_point.addGeometry(QgsPoint(x, y))
+        index.addFeature(row, QgsRectangle(x, y, x, y))
+    extent = QgsGeometry.fromRect(
+        multi_point.boundingBox().buffered(2 * radius))
+    diagram = QgsGeometry(multi_point).voronoiDiagram(extent)
+    count('voronoiDiagram')
+
+    # Match every cell to the one pole inside it
+    areas = {}
+    for cell in diagram.asGeometryCollection():
+        engine = QgsGeometry.createGeometryEngine(cell.constGet())
+        engine.prepareGeometry()
+        for row in index.intersects(cell.boundingBox()):
+            if row in areas:
+                continue
+            x, y = points[row]
+            if engine.intersects(QgsPoint(x, y)):
+                areas[row] = cell.intersection(buffers[row])
+                break
+    return [areas.get(row_of[(x, y)], buffers[row_of[(x, y)]]) for x, y in points]
+
+
+def service_areas_layer(poles_layer, radius, name='service_areas', segments=8, transforms=None,
+                        tile_size=None, max_workers=None):
+    # Polygon layer with the clipped Voronoi cell of every pole and the pole's
+    # attributes, in the CRS of the pole layer. With tile_size (metres) the
+    # cells are built per tile in a process pool.
+    transforms = transforms or shared_transform_service()
+    with stage('read') as record:
+        pole_fids, pole_points = layer_points(poles_layer)
+        record['features'] = len(pole_fids)
+    with stage('project', len(pole_fids)):
+        pole_metres, epsg = project_to_metres(
+            pole_points, poles_layer.crs(), transforms=transforms)
+    with stage('voronoi_clip', len(pole_fids)):
+        if tile_size:
+            from tiling import tiled_service_area_geometries
+            geometries = tiled_service_area_geometries(
+                pole_metres, radius, segments, tile_size, max_workers)
+        else:
+            geometries = service_area_geometries(pole_metres, radius, segments)
+
+    layer = QgsVectorLayer(
+        f'Polygon?crs={poles_layer.crs().authid()}', name, 'memory')
+    layer.dataProvider().addAttributes(poles_layer.fields().toList())
+    layer.updateFields()
+
+    with stage('write', len(geometries)):
+        to_source = transforms.from_utm_transform(epsg, poles_layer.crs())
+        geometry_of = dict(zip(pole_fids.tolist(), geometries))
+        features = []
+        count('getFeatures')
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        for pole in poles_layer.getFeatures(request):
+            geometry = geometry_of.get(pole.id())
+            if geometry is None or geometry.isEmpty():
+                continue
+            geometry = QgsGeometry(geometry)
+            geometry.transform(to_source)
+            feature = QgsFeature(layer.fields())
+            feature.setGeometry(geometry)
+            feature.setAttributes(pole.attributes())
+            features.append(feature)
+        layer.dataProvider().addFeatures(features)
+        layer.updateExtents()
+    return layer
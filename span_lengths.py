@@ -0,0 +1,102 @@
+import numpy as np
+from qgis.core import NULL, QgsFeatureRequest, QgsField
+from qgis.PyQt.QtCore import QVariant
+
+from geometry_core.geodesic import geodesic_lengths
+from geometry_core.spans import polyline_lengths
+from instrumentation import count, stage
+from transform_service import shared_transform_service
+
+
+def segment_lengths(points_a, points_b, source_crs, transforms=None):
+    # Geodesic length of every a -> b segment given in source_crs
+    transforms = transforms or shared_transform_service()
+    return geodesic_lengths(transforms.geographic(points_a, source_crs),
+                            transforms.geographic(points_b, source_crs))
+
+
+def read_lines(layer, key_field=None, fids=None):
+    # Vertices of every line part as one array plus part offsets, the line each
+    # part belongs to, and the key attribute (the pole at the end of the span).
+    # fids restricts the read to those lines.
+    request = QgsFeatureRequest()
+    request.setSubsetOfAttributes([key_field] if key_field else [], layer.fields())
+    if fids is not None:
+        request.setFilterFids(list(fids))
+    line_fids, keys, vertices, counts, part_lines = [], [], [], [], []
+    count('getFeatures')
+    for feature in layer.getFeatures(request):
+        geometry = feature.geometry()
+        if geometry.isNull():
+            continue
+        parts = geometry.asMultiPolyline() if geometry.isMultipart() else [geometry.asPolyline()]
+        # Every part is measured on its own, the gap between parts is no span
+        for part in parts:
+            vertices.extend((point.x(), point.y()) for point in part)
+            counts.append(len(part))
+            part_lines.append(len(line_fids))
+        line_fids.append(feature.id())
+        keys.append(feature[key_field] if key_field else None)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return (np.array(line_fids, dtype=np.int64), keys,
+            np.array(vertices, dtype=float).reshape(-1, 2), offsets,
+            np.array(part_lines, dtype=np.int64))
+
+
+def line_lengths(vertices, offsets, part_lines, line_count, source_crs, transforms=None):
+    # Geodesic length of every line, the sum of its parts; vertices given in source_crs
+    transforms = transforms or shared_transform_service()
+    part_lengths = polyline_lengths(transforms.geographic(vertices, source_crs), offsets)
+    return np.bincount(part_lines, weights=part_lengths, minlength=line_count).astype(float)
+
+
+def ensure_double_field(layer, field_name):
+    if layer.fields().indexFromName(field_name) < 0:
+        layer.dataProvider().addAttributes([QgsField(field_name, QVariant.Double)])
+        layer.updateFields()
+    return layer.fields().indexFromName(field_name)
+
+
+def update_span_lengths(line_layer, pole_layer=None, line_fields=('back_span', 'span_length'),
+                        pole_field='back_span', pole_number_field='pole_number', fids=None, decimals=2):
+    # Write the geodesic length of every span to the line fields that exist
+    # (span_length is added when none does) and to the back_span of the pole the
+    # span ends at, matched on back_span_pole or pole_number. Each layer gets one
+    # bulk update; pass the fids of edited lines to refresh only those spans.
+    field_names = line_layer.fields().names()
+    key_field = next((field_name for field_name in ('back_span_pole', pole_number_field)
+                      if field_name in field_names), None)
+    with stage('read_lines') as record:
+        line_fids, keys, vertices, offsets, part_lines = read_lines(line_layer, key_field, fids)
+        record['features'] = len(line_fids)
+    with stage('geodesic', len(line_fids)):
+        lengths = np.round(line_lengths(
+            vertices, offsets, part_lines, len(line_fids), line_layer.crs()), decimals)
+
+    with stage('write_lines', len(line_fids)):
+        targets = [field_name for field_name in line_fields if field_name in field_names] \
+            or [line_fields[-1]]
+        indexes = [ensure_double_field(line_layer, field_name) for field_name in targets]
+        line_layer.dataProvider().changeAttributeValues(
+            {int(fid): {index: float(length) for index in indexes}
+             for fid, length in zip(line_fids, lengths)})
+
+    if pole_layer is None or key_field is None:
+        return dict(zip(line_fids.tolist(), lengths.tolist()))
+
+    with stage('write_poles') as record:
+        pole_index = ensure_double_field(pole_layer, pole_field)
+        length_of = {key: float(length) for key, length in zip(keys, lengths)
+                     if key is not None and key != NULL}
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry) \
+            .setSubsetOfAttributes([pole_number_field], pole_layer.fields())
+        attr_map = {}
+        count('getFeatures')
+        for feature in pole_layer.getFeatures(request):
+            length = length_of.get(feature[pole_number_field])
+            if length is not None:
+                attr_map[feature.id()] = {pole_index: length}
+        pole_layer.dataProvider().changeAttributeValues(attr_map)
+        record['features'] = len(attr_map)
+    return dict(zip(line_fids.tolist(), lengths.tolist()))
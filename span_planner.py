@@ -0,0 +1,185 @@
+import numpy as np
+
+
+class SpanTable:
+    # Memoized span counts keyed by (quantized length, min_span, max_span).
+    # Networks repeat the same segment lengths over and over, so after the
+    # first lookup every repeat is a dict hit. Lengths are rounded up to the
+    # quantum, so a length just over max_span never plans too few spans.
+
+    def __init__(self, quantum=0.01):
+        self.quantum = quantum
+        self.table = {}
+
+    @staticmethod
+    def plan(length, min_span, max_span):
+        # Fewest spans that keep every span at most max_span long. When no count
+        # keeps the spans inside [min_span, max_span] (e.g. 230 m with 100-110 m
+        # spans) the spans stay under max_span and fall short of min_span.
+        return max(1, int(np.ceil(length / max_span - 1e-9)))
+
+    def quantize(self, lengths):
+        # Quanta covering the length; the tolerance keeps float noise in an
+        # exact multiple (110.0 / 0.01 = 11000.000000000002) from adding one
+        return np.ceil(np.asarray(lengths, dtype=float) / self.quantum - 1e-6).astype(np.int64)
+
+    def count(self, length, min_span, max_span):
+        key = (int(self.quantize(length)), min_span, max_span)
+        if key not in self.table:
+            self.table[key] = self.plan(key[0] * self.quantum, min_span, max_span)
+        return self.table[key]
+
+    def counts(self, lengths, min_spans, max_spans):
+        # Span count of every segment; only lengths not seen before are planned
+        lengths = np.asarray(lengths, dtype=float)
+        quantized = self.quantize(lengths)
+        min_spans = np.broadcast_to(np.asarray(min_spans, dtype=float), lengths.shape)
+        max_spans = np.broadcast_to(np.asarray(max_spans, dtype=float), lengths.shape)
+        keys, inverse = np.unique(np.column_stack([quantized, min_spans, max_spans]),
+                                  axis=0, return_inverse=True)
+        unique_counts = np.array([self.count(q * self.quantum, low, high)
+                                  for q, low, high in keys], dtype=np.int64)
+        return unique_counts[inverse.reshape(-1)]
+
+    def cost(self, length, min_span, max_span):
+        # (poles, metres short of min_span) of one straight run, compared as a tuple
+        spans = self.count(length, min_span, max_span)
+        return spans, max(0.0, min_span - length / spans) * spans
+
+
+# One table per session, shared by every network drawn
+SPAN_TABLE = SpanTable()
+
+
+def span_limits(profile, branches, total_distances):
+    # (min_spans, max_spans) of every branch: the profile defaults overridden by
+    # the first matching site rule
+    total_distances = np.asarray(total_distances, dtype=float)
+    min_spans = np.full(len(total_distances), float(profile.get('min_span', 0)))
+    max_spans = np.full(len(total_distances), float(profile['max_span']))
+    matched = np.zeros(len(total_distances), dtype=bool)
+    control_poles = [control_pole for control_pole, _ in branches]
+    for rule in profile.get('span_rules', []):
+        mask = ~matched
+        if 'control_pole_prefix' in rule:
+            mask &= np.array([str(control_pole).startswith(rule['control_pole_prefix'])
+                              for control_pole in control_poles], dtype=bool)
+        if 'min_length' in rule:
+            mask &= total_distances > rule['min_length']
+        if 'max_length' in rule:
+            mask &= total_distances <= rule['max_length']
+        min_spans[mask] = rule.get('min_span', min_spans[mask])
+        max_spans[mask] = rule['max_span']
+        matched |= mask
+    return min_spans, max_spans
+
+
+def deflections(previous, current, following):
+    # Turning angle in degrees at current between previous -> current -> following
+    incoming = np.asarray(current, dtype=float) - np.asarray(previous, dtype=float)
+    outgoing = np.asarray(following, dtype=float) - np.asarray(current, dtype=float)
+    angle = np.degrees(np.arctan2(incoming[..., 0] * outgoing[..., 1] - incoming[..., 1] * outgoing[..., 0],
+                                  np.einsum('...i,...i->...', incoming, outgoing)))
+    return np.abs(angle)
+
+
+def chord_offsets(start, end, points):
+    # Distance of every point from the straight start -> end line
+    start, end = np.asarray(start, dtype=float), np.asarray(end, dtype=float)
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    direction = end - start
+    length = np.hypot(*direction)
+    if length == 0:
+        return np.hypot(*(points - start).T)
+    relative = points - start
+    return np.abs(direction[0] * relative[:, 1] - direction[1] * relative[:, 0]) / length
+
+
+def droppable_control_poles(cp_index, coords, profile):
+    # Control poles a straight run may pass without a pole: exactly one child,
+    # a turning angle under max_straight_angle and no site rule naming them.
+    # The root, branch points, end points and angle points always keep their pole.
+    max_angle = profile.get('max_straight_angle', 2.0)
+    kept_prefixes = tuple(rule['control_pole_prefix'] for rule in profile.get('span_rules', [])
+                          if 'control_pole_prefix' in rule)
+    droppable = set()
+    for control_pole, parent in cp_index.branches():
+        children = cp_index.children.get(control_pole, [])
+        if len(children) != 1:
+            continue
+        if kept_prefixes and str(control_pole).startswith(kept_prefixes):
+            continue
+        if deflections(coords[parent], coords[control_pole], coords[children[0]]) < max_angle:
+            droppable.add(control_pole)
+    return droppable
+
+
+def plan_chain(chain, coords, limits, max_offset, table=SPAN_TABLE, max_run=8):
+    # Dynamic program over one run of control poles whose interior ones may be
+    # dropped: keep the subset that needs the fewest poles (then the fewest
+    # metres short of min_span), never straying more than max_offset metres from
+    # a dropped control pole. limits(control_pole, length) gives the
+    # (min_span, max_span) of a run ending at control_pole. A run bridges at most
+    # max_run control poles, so a chain of n costs O(n * max_run**2) rather than
+    # O(n**3). Returns the kept control poles, ends included.
+    points = np.array([coords[control_pole] for control_pole in chain], dtype=float)
+    best = [(0, 0.0)] + [None] * (len(chain) - 1)
+    previous = [None] * len(chain)
+    for j in range(1, len(chain)):
+        for i in range(max(0, j - max_run - 1), j):
+            if best[i] is None:
+                continue
+            if i < j - 1 and chord_offsets(points[i], points[j], points[i + 1:j]).max() > max_offset:
+                continue
+            length = np.hypot(*(points[j] - points[i]))
+            run = table.cost(length, *limits(chain[j], length))
+            cost = (best[i][0] + run[0], best[i][1] + run[1])
+            if best[j] is None or cost < best[j]:
+                best[j], previous[j] = cost, i
+    kept, j = [], len(chain) - 1
+    while j is not None:
+        kept.append(chain[j])
+        j = previous[j]
+    return kept[::-1]
+
+
+def plan_branches(cp_index, coords, profile, table=SPAN_TABLE):
+    # All branches of a network in one call. coords maps control pole -> projected
+    # (x, y) in metres. With drop_straight_control_poles the straight runs are
+    # optimized and the dropped control poles are bridged, so a branch can end at
+    # a farther ancestor; otherwise the branches are unchanged.
+    branches = list(cp_index.branches())
+    if not profile.get('drop_straight_control_poles'):
+        return branches, set()
+
+    droppable = droppable_control_poles(cp_index, coords, profile)
+    max_offset = profile.get('max_straight_offset', 1.0)
+    max_run = profile.get('max_straight_run', 8)
+    dropped = set()
+
+    def limits(control_pole, length):
+        min_spans, max_spans = span_limits(profile, [(control_pole, None)], [length])
+        return min_spans[0], max_spans[0]
+
+    # A chain starts at every kept control pole with a droppable child and runs
+    # down to the next control pole that must keep its pole
+    chain_starts = {parent for control_pole, parent in branches
+                    if control_pole in droppable and parent not in droppable}
+    for start in chain_starts:
+        for child in cp_index.children.get(start, []):
+            if child not in droppable:
+                continue
+            chain = [start, child]
+            while chain[-1] in droppable:
+                chain.append(cp_index.children[chain[-1]][0])
+            kept = set(plan_chain(chain, coords, limits, max_offset, table, max_run))
+            dropped.update(control_pole for control_pole in chain if control_pole not in kept)
+
+    planned = []
+    for control_pole, parent in branches:
+        if control_pole in dropped:
+            continue
+        while parent in dropped:
+            parent = cp_index.parent[parent]
+        planned.append((control_pole, parent))
+    return planned, dropped
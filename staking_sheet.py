@@ -0,0 +1,289 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, stage
+
+
+# Staking sheet column -> header, in sheet order
+TABLE_HEADERS = {'pole_number': 'Pole Number', 'latitude': 'Latitude', 'longitude': 'Longitude',
+                 'height': 'Class & height', 'line_angle': 'Angle', 'primary_back_span': 'Back span', 'primary_structure': 'Structure Type', 'back_span': 'Secondary Back span',
+                 'structure_qty': 'Structure Quantity', 'structure_unit': 'J', 'conductor': 'Conductor Size',
+                 'grounding_assembly': 'Ground Unit M', 'guy_qty': 'Quantity', 'guy_type': 'Guy Type',
+                 'guy_lead': 'Guy Lead (m)', 'anchor_qty': 'Anchor Quantity', 'anchor_type': 'Anchor Type',
+                 'k_10': 'Single Phase Qty', 'single_phase_unit': 'Single phase unit', 'k_30': 'Three-Phase Qty', 'three_phase_unit': 'Three-phase unit',
+                 'streetlight': 'Streetlight M unit'}
+
+# Pole layer field -> attribute position it had in the original pole layers,
+# used when a layer does not have the field under that name
+STAKING_FIELDS = {'pole_number': 1, 'back_span': 3, 'height': 4, 'grounding_assembly': 5, 'guy': 6,
+                  'j_19': 7, 'j_10': 8, 'k_10': 9, 'k_30': 10, 'conductor': 11, 'latitude': 12,
+                  'longitude': 13, 'streetlight': 14, 'line_angle': 16, 'primary_structure': 17}
+
+HEIGHTS = {'30ft': '30\'/6', '35ft': '35\'/5'}
+
+
+def line_type_of(layer_name):
+    # 'mv' for mv_poles..., 'lv' for lv_poles...
+    return layer_name[:2]
+
+
+def field_indexes(layer, field_names):
+    # Field name -> attribute index, by name first and by the known position otherwise
+    fields = layer.fields()
+    indexes = {}
+    for field_name in field_names:
+        index = fields.indexFromName(field_name)
+        if index < 0:
+            index = STAKING_FIELDS.get(field_name, -1)
+        if index < 0 or index >= fields.count():
+            raise KeyError(f'{layer.name()} has no {field_name} field')
+        indexes[field_name] = index
+    return indexes
+
+
+def missing_staking_fields(field_names, line_type):
+    # Staking sheet fields missing from a layer with these fields, in the same
+    # by name or by known position way field_indexes looks them up
+    required = list(STAKING_FIELDS) + (['pole_id'] if line_type == 'mv' else [])
+    return [field_name for field_name in required
+            if field_name not in field_names
+            and not 0 <= STAKING_FIELDS.get(field_name, -1) < len(field_names)]
+
+
+def read_staking_columns(layer, line_type):
+    # Only the staking sheet attributes, without geometry, as a DataFrame of
+    # Python values (NULL becomes None). mv sheets are sorted by pole_id.
+    # QGIS is only imported here, so the rules and writers (and the worker
+    # processes building the tables) run without it.
+    from qgis.core import NULL, QgsFeatureRequest
+
+    field_names = list(STAKING_FIELDS) + (['pole_id'] if line_type == 'mv' else [])
+    indexes = field_indexes(layer, field_names)
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry) \
+        .setSubsetOfAttributes(list(indexes.values()))
+
+    columns = {field_name: [] for field_name in indexes}
+    count('getFeatures')
+    for feature in layer.getFeatures(request):
+        attributes = feature.attributes()
+        for field_name, index in indexes.items():
+            value = attributes[index]
+            columns[field_name].append(None if value == NULL else value)
+
+    table = pd.DataFrame({field_name: pd.Series(values, dtype=object)
+                          for field_name, values in columns.items()})
+    if line_type == 'mv':
+        table = table.sort_values('pole_id', kind='stable').reset_index(drop=True)
+    return table
+
+
+def blank_if_none(column):
+    return column.where(column.notna(), '')
+
+
+def truthy(column):
+    return np.fromiter(map(bool, column), dtype=bool, count=len(column))
+
+
+def structure_columns(j_10, j_19):
+    # Structure quantity and J unit from the J10/J19 counts. Only j_10 is
+    # checked for NULL, like the original per-feature rule.
+    j10_text = j_10.map(str)
+    j19_text = j_19.map(str)
+    conditions = [j_10.isna().to_numpy(), (j_10 == 0).to_numpy(), (j_19 == 0).to_numpy(),
+                  ((j_10 == 1) & (j_19 == 1)).to_numpy(), (j_10 == 1).to_numpy(), (j_19 == 1).to_numpy()]
+    quantity = np.select(conditions, [np.array(''), j_19.to_numpy(), j_10.to_numpy(), 1, 1, 1],
+                         default=1).astype(object)
+    unit = np.select(conditions, ['', 'J19', 'J10', 'J10 + J19',
+                                  ('J10 + ' + j19_text + 'J19').to_numpy(),
+                                  (j10_text + 'J10 + J19').to_numpy()],
+                     default=(j10_text + 'J10 + ' + j19_text + 'J19').to_numpy()).astype(object)
+    return quantity, unit
+
+
+def staking_table(columns, line_type):
+    # Apply the height, J10/J19, guy, anchor and K10/K30 rules to every pole at once
+    is_mv = line_type == 'mv'
+    table = pd.DataFrame(index=columns.index)
+    table['pole_number'] = columns['pole_number']
+    table['latitude'] = columns['latitude']
+    table['longitude'] = columns['longitude']
+    table['height'] = columns['height'].map(HEIGHTS).fillna('40\'/4')
+    table['line_angle'] = columns['line_angle']
+    table['primary_back_span'] = columns['back_span'] if is_mv else ''
+    table['primary_structure'] = columns['primary_structure']
+    table['back_span'] = '' if is_mv else columns['back_span']
+    table['structure_qty'], table['structure_unit'] = structure_columns(
+        columns['j_10'], columns['j_19'])
+    table['conductor'] = columns['conductor']
+    table['grounding_assembly'] = blank_if_none(columns['grounding_assembly'])
+
+    guy = columns['guy'].map(str).str.split(' x ')
+    has_guy = (guy.str.len() == 2).to_numpy()
+    guy_qty = np.full(len(columns), '', dtype=object)
+    guy_qty[has_guy] = guy[has_guy].str[0].map(int).tolist()
+    table['guy_qty'] = guy_qty
+    table['guy_type'] = np.where(has_guy, guy.str[1].fillna(''), '').astype(object)
+    guyed = truthy(guy_qty)
+    table['guy_lead'] = pd.Series('', index=columns.index, dtype=object)
+    table.loc[guyed, 'guy_lead'] = 11 if is_mv else 7
+    table['anchor_qty'] = guy_qty
+    table['anchor_type'] = np.where(guyed, 'F1-2' if is_mv else 'F1-1', '')
+
+    table['k_10'] = blank_if_none(columns['k_10'])
+    table['single_phase_unit'] = np.where(truthy(table['k_10']), 'K10', '')
+    table['k_30'] = blank_if_none(columns['k_30'])
+    table['three_phase_unit'] = np.where(truthy(table['k_30']), 'K30', '')
+    table['streetlight'] = blank_if_none(columns['streetlight'])
+    return table.rename(columns=TABLE_HEADERS)[list(TABLE_HEADERS.values())]
+
+
+def sheet_name(name, used=()):
+    # Excel sheet names are at most 31 characters, unique and without []:*?/\
+    base = re.sub(r'[\[\]:*?/\\]', '_', name)[:31] or 'Sheet'
+    candidate, n = base, 1
+    while candidate.lower() in {existing.lower() for existing in used}:
+        n += 1
+        suffix = f'~{n}'
+        candidate = base[:31 - len(suffix)] + suffix
+    return candidate
+
+
+def write_sheet(workbook, table, name, header_format):
+    # Stream one sheet row by row, laid out like DataFrame.to_excel(index=True):
+    # index in column A, bold headers
+    worksheet = workbook.add_worksheet(name)
+    worksheet.write_row(0, 1, list(table.columns), header_format)
+
+    columns = [table[column].tolist() for column in table.columns]
+    for row, (index, values) in enumerate(zip(table.index.tolist(), zip(*columns)), start=1):
+        worksheet.write(row, 0, index, header_format)
+        for column, value in enumerate(values, start=1):
+            if value is not None and value != '':
+                worksheet.write(row, column, value)
+    return worksheet
+
+
+def write_workbook(tables, path):
+    # One sheet per {sheet name: table}, written with xlsxwriter in constant
+    # memory mode so only the current row is held in memory
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    header_format = workbook.add_format(
+        {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    for name, table in tables.items():
+        write_sheet(workbook, table, name, header_format)
+    workbook.close()
+    return path
+
+
+def write_xlsx(table, path, sheet_name='Sheet1'):
+    return write_workbook({sheet_name: table}, path)
+
+
+def write_csv(table, path):
+    # Same columns and index as the Excel sheet; None and '' both become empty cells
+    table.to_csv(path, index=True)
+    return path
+
+
+def typed_columns(table):
+    # Parquet needs one type per column: columns whose non-blank values are all
+    # numbers become numeric (blank -> null), everything else becomes text
+    typed = pd.DataFrame(index=table.index)
+    for column in table.columns:
+        values = table[column].where(table[column] != '', None)
+        present = values.dropna()
+        if present.map(lambda value: isinstance(value, (int, float, np.number))
+                       and not isinstance(value, bool)).all():
+            integers = present.map(lambda value: isinstance(value, (int, np.integer))).all()
+            typed[column] = pd.to_numeric(values).astype('Int64' if integers else 'float64')
+        else:
+            typed[column] = values.map(lambda value: None if value is None else str(value))
+    return typed
+
+
+def write_parquet(table, path):
+    # Needs pyarrow or fastparquet
+    typed_columns(table).to_parquet(path, index=True)
+    return path
+
+
+# Output format -> writer(table, path)
+WRITERS = {
+    'xlsx': write_xlsx,
+    'csv': write_csv,
+    'parquet': write_parquet,
+}
+
+
+def output_format_of(path):
+    return os.path.splitext(path)[1].lstrip('.').lower()
+
+
+def export_staking_sheet(layer, path, line_type, output_format=None):
+    # output_format is one of WRITERS, taken from the file extension by default
+    output_format = output_format or output_format_of(path)
+    if output_format not in WRITERS:
+        raise ValueError(
+            f'Unknown staking sheet format {output_format}, expected one of {", ".join(WRITERS)}')
+    with stage('read') as record:
+        columns = read_staking_columns(layer, line_type)
+        record['features'] = len(columns)
+    with stage('build', len(columns)):
+        table = staking_table(columns, line_type)
+    with stage(f'write_{output_format}', len(table)):
+        WRITERS[output_format](table, path)
+    return table
+
+
+def summary_table(layer_names, sheet_names, line_types, tables):
+    # One row per exported layer with the totals the nightly report looks at
+    rows = []
+    for layer_name, name, line_type, table in zip(layer_names, sheet_names, line_types, tables):
+        rows.append({
+            'Layer': layer_name,
+            'Sheet': name,
+            'Line type': line_type.upper(),
+            'Poles': len(table),
+            'Guyed poles': int(table[TABLE_HEADERS['guy_qty']].map(bool).sum()),
+            'Single Phase Qty': pd.to_numeric(table[TABLE_HEADERS['k_10']], errors='coerce').sum(),
+            'Three-Phase Qty': pd.to_numeric(table[TABLE_HEADERS['k_30']], errors='coerce').sum(),
+            'Streetlights': pd.to_numeric(table[TABLE_HEADERS['streetlight']], errors='coerce').sum(),
+        })
+    return pd.DataFrame(rows)
+
+
+def export_staking_sheets(layers, path, max_workers=None, summary_sheet='Summary'):
+    # Every layer in one workbook: a sheet per layer plus a summary sheet.
+    # QGIS features are read in this process; the row rules run in a process
+    # pool (max_workers=0 keeps everything in this process, e.g. inside the
+    # QGIS desktop on Windows where workers would start a new QGIS).
+    layer_names = [layer.name() for layer in layers]
+    line_types = [line_type_of(layer_name) for layer_name in layer_names]
+    with stage('read') as record:
+        columns = [read_staking_columns(layer, line_type)
+                   for layer, line_type in zip(layers, line_types)]
+        record['features'] = sum(len(layer_columns) for layer_columns in columns)
+
+    with stage('build', record['features']):
+        if max_workers == 0 or len(layers) < 2:
+            tables = list(map(staking_table, columns, line_types))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                tables = list(executor.map(staking_table, columns, line_types))
+
+    used = [summary_sheet]
+    for layer_name in layer_names:
+        used.append(sheet_name(layer_name, used))
+    sheet_names = used[1:]
+    summary = summary_table(layer_names, sheet_names, line_types, tables)
+
+    with stage('write', record['features']):
+        write_workbook({summary_sheet: summary, **dict(zip(sheet_names, tables))}, path)
+    return summary
@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+from qgis.core import (QgsFeature, QgsFeatureRequest, QgsField, QgsGeometry, QgsPointXY,
+                       QgsProject, QgsVectorFileWriter, QgsVectorLayer, QgsWkbTypes)
+from PyQt5.QtCore import QVariant
+
+from geometry_core.neighbours import count_within_radii
+from instrumentation import count, stage
+from transform_service import shared_transform_service
+
+
+def layer_points(layer):
+    # Feature ids and point coordinates of a layer, without attributes
+    request = QgsFeatureRequest().setNoAttributes()
+    is_point = layer.geometryType() == QgsWkbTypes.PointGeometry
+    fids, points = [], []
+    count('getFeatures')
+    for feature in layer.getFeatures(request):
+        geometry = feature.geometry()
+        if geometry.isNull():
+            continue
+        point = geometry.asPoint() if is_point and not geometry.isMultipart() \
+            else geometry.centroid().asPoint()
+        fids.append(feature.id())
+        points.append((point.x(), point.y()))
+    return np.array(fids, dtype=np.int64), np.array(points, dtype=float).reshape(-1, 2)
+
+
+def project_to_metres(points, source_crs, epsg=None, transforms=None):
+    # Project to one UTM zone: the zone most of the points fall in unless given
+    transforms = transforms or shared_transform_service()
+    if epsg is None:
+        codes = transforms.utm_epsg_codes(points, source_crs)
+        values, frequency = np.unique(codes, return_counts=True)
+        epsg = int(values[np.argmax(frequency)]) if len(values) else 32629
+    return transforms.to_utm(points, source_crs, epsg), epsg
+
+
+def structure_counts(poles_layer, structures_layer, radii, tile_size=None, max_workers=None):
+    # radii maps output field name -> radius in metres, e.g. {'structure_count': 30}.
+    # Returns the pole feature ids and {field name: counts}. With tile_size (metres)
+    # the counting is split into tiles run in a process pool.
+    with stage('read_layers') as record:
+        pole_fids, pole_points = layer_points(poles_layer)
+        _, structure_points = layer_points(structures_layer)
+        record['features'] = len(pole_points) + len(structure_points)
+    with stage('project', len(pole_points) + len(structure_points)):
+        pole_metres, epsg = project_to_metres(pole_points, poles_layer.crs())
+        structure_metres, _ = project_to_metres(
+            structure_points, structures_layer.crs(), epsg)
+
+    with stage('count', len(pole_points)):
+        if tile_size:
+            from tiling import tiled_count_within_radii
+            counts = tiled_count_within_radii(
+                pole_metres, structure_metres, list(radii.values()), tile_size, max_workers)
+        else:
+            counts = count_within_radii(
+                pole_metres, structure_metres, list(radii.values()))
+    return pole_fids, dict(zip(radii.keys(), counts))
+
+
+def write_structure_counts(layer, pole_fids, counts):
+    # Add the count fields when missing and write every count in one bulk change
+    provider = layer.dataProvider()
+    missing = [QgsField(field_name, QVariant.Int)
+               for field_name in counts if field_name not in layer.fields().names()]
+    if missing:
+        provider.addAttributes(missing)
+        layer.updateFields()
+
+    field_indexes = {field_name: layer.fields().indexFromName(field_name)
+                     for field_name in counts}
+    attr_map = {int(fid): {field_indexes[field_name]: int(values[i]) for field_name, values in counts.items()}
+                for i, fid in enumerate(pole_fids)}
+    with stage('write_counts', len(attr_map)):
+        return provider.changeAttributeValues(attr_map)
+
+
+def counts_layer(poles_layer, structures_layer, radii, name, tile_size=None, max_workers=None):
+    # In-memory copy of the poles with the count fields filled in, instead of a
+    # full shapefile round-trip
+    result = poles_layer.materialize(QgsFeatureRequest())
+    result.setName(name)
+    pole_fids, counts = structure_counts(
+        result, structures_layer, radii, tile_size, max_workers)
+    write_structure_counts(result, pole_fids, counts)
+    return result
+
+
+def buffer_layer(poles_layer, radius, name='buffer_layer', segments=5):
+    # Metric buffer polygon around every pole, only built when asked for
+    transforms = shared_transform_service()
+    pole_fids, pole_points = layer_points(poles_layer)
+    pole_metres, epsg = project_to_metres(pole_points, poles_layer.crs())
+    to_source = transforms.from_utm_transform(epsg, poles_layer.crs())
+
+    layer = QgsVectorLayer(
+        f'Polygon?crs={poles_layer.crs().authid()}', name, 'memory')
+    layer.dataProvider().addAttributes([QgsField('id', QVariant.Int)])
+    layer.updateFields()
+    features = []
+    for fid, (x, y) in zip(pole_fids, pole_metres):
+        geometry = QgsGeometry.fromPointXY(
+            QgsPointXY(x, y)).buffer(radius, segments)
+        geometry.transform(to_source)
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(geometry)
+        feature.setAttribute('id', int(fid))
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    layer.updateExtents()
+    return layer
+
+
+def save_to_geopackage(layer, path, layer_name=None):
+    # Write a layer into a GeoPackage in one transaction, replacing the table
+    # if it exists, and return the on-disk layer
+    layer_name = layer_name or layer.name()
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = 'GPKG'
+    options.layerName = layer_name
+    if os.path.exists(path):
+        options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+    error, message, _, _ = QgsVectorFileWriter.writeAsVectorFormatV3(
+        layer, path, QgsProject.instance().transformContext(), options)
+    if error != QgsVectorFileWriter.NoError:
+        raise RuntimeError(f'Could not write {layer_name} to {path}: {message}')
+    return QgsVectorLayer(f'{path}|layername={layer_name}', layer_name, 'ogr')
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from geometry_core.angles import angle_labels, span_angles
+from geometry_core.geodesic import geodesic_lengths
+from geometry_core.neighbours import count_within_radii
+from geometry_core.projection import transform_coords, utm_epsg_codes
+from geometry_core.spans import polyline_lengths
+
+# One degree of longitude on the WGS84 equator
+EQUATOR_DEGREE = 111319.49079327357
+
+
+def test_transform_coords_central_meridian():
+    # 33E is the central meridian of UTM zone 36
+    x, y = transform_coords([[33.0, 0.0]], 4326, 32636)[0]
+    assert x == pytest.approx(500000.0)
+    assert y == pytest.approx(0.0, abs=1e-6)
+
+
+def test_transform_coords_round_trip():
+    lonlat = np.array([[32.58, 0.31], [32.61, -0.02], [33.2, 1.5]])
+    utm = transform_coords(lonlat, 4326, 32636)
+    assert np.allclose(transform_coords(utm, 32636, 4326), lonlat, atol=1e-9)
+
+
+def test_transform_coords_same_crs_and_empty():
+    coords = np.array([[1.0, 2.0]])
+    same = transform_coords(coords, 4326, 4326)
+    assert np.array_equal(same, coords)
+    assert same is not coords
+    assert transform_coords(np.zeros((0, 2)), 4326, 32636).shape == (0, 2)
+
+
+def test_utm_epsg_codes_hemispheres():
+    assert utm_epsg_codes([[33.0, 0.3], [33.0, -0.3], [-0.1, 51.5]]).tolist() == [32636, 32736, 32630]
+
+
+def test_geodesic_lengths():
+    lengths = geodesic_lengths([[0.0, 0.0], [32.5, 0.3], [10.0, 10.0]],
+                               [[1.0, 0.0], [32.5, 0.3], [10.0, 11.0]])
+    assert lengths[0] == pytest.approx(EQUATOR_DEGREE, rel=1e-9)
+    assert lengths[1] == 0
+    # A degree of latitude is about 110.6 km near 10N
+    assert lengths[2] == pytest.approx(110.6e3, rel=1e-3)
+    assert geodesic_lengths(np.zeros((0, 2)), np.zeros((0, 2))).shape == (0,)
+
+
+def test_span_angles_and_labels():
+    # East, then north (90 degrees left), then a 0.5 degree kink (under the
+    # dead band), then a 1 degree kink back, then the last span
+    starts = np.array([[0.0, 0.0], [10.0, 0.0], [10.0, 10.0], [10.0873, 20.0]])
+    ends = np.array([[10.0, 0.0], [10.0, 10.0], [10.0873, 20.0], [10.0, 30.0]])
+    angles = span_angles(starts, ends, [1, 2, 3, 4], dead_band=1.0)
+    assert angles[0] == pytest.approx(90.0)
+    assert angles[1] == 0
+    assert angles[2] == pytest.approx(1.0, abs=0.01)
+    assert angles[3] == 0
+    assert angle_labels(np.array([90.0, -12.4, 0.0])).tolist() == ['90°L', '12°R', '0°']
+
+
+def test_span_angles_without_next_span():
+    # Span 3 is missing, so span 2 has nothing to turn into
+    angles = span_angles(np.zeros((3, 2)), np.array([[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]]), [1, 2, 4])
+    assert angles[1] == 0
+    assert angles[2] == 0
+
+
+def test_polyline_lengths():
+    lonlat = np.array([[0.0, 0.0], [1.0, 0.0], [5.0, 0.0], [6.0, 0.0], [7.0, 0.0]])
+    # An empty first line, a two-vertex line, an empty line, a three-vertex line
+    lengths = polyline_lengths(lonlat, [0, 0, 2, 2, 5])
+    assert lengths == pytest.approx([0.0, EQUATOR_DEGREE, 0.0, 2 * EQUATOR_DEGREE])
+
+
+def test_polyline_lengths_single_vertex_and_empty():
+    assert polyline_lengths([[0.0, 0.0], [1.0, 0.0]], [0, 1, 2]).tolist() == [0.0, 0.0]
+    assert polyline_lengths(np.zeros((0, 2)), [0, 0]).tolist() == [0.0]
+    assert polyline_lengths(np.zeros((0, 2)), [0]).shape == (0,)
+
+
+def test_count_within_radii_matches_brute_force():
+    rng = np.random.default_rng(7)
+    points = rng.uniform(0, 500, (300, 2))
+    structures = rng.uniform(-50, 550, (2000, 2))
+    radii = [10.0, 30.0]
+    counts = count_within_radii(points, structures, radii, chunk_size=64)
+    distances = np.hypot(*(points[:, None, :] - structures[None, :, :]).transpose(2, 0, 1))
+    for r, radius in enumerate(radii):
+        assert counts[r].tolist() == (distances <= radius).sum(axis=1).tolist()
+
+
+def test_count_within_radii_inclusive_and_empty():
+    counts = count_within_radii([[0.0, 0.0]], [[30.0, 0.0], [30.1, 0.0]], [30])
+    assert counts.tolist() == [[1]]
+    assert count_within_radii(np.zeros((0, 2)), [[0.0, 0.0]], [30]).shape == (1, 0)
+    assert count_within_radii([[0.0, 0.0]], np.zeros((0, 2)), [30]).tolist() == [[0]]
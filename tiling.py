@@ -0,0 +1,132 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from geometry_core.neighbours import count_within_radii
+from instrumentation import stage
+
+
+def tile_buckets(coords, origin, tile_size):
+    # {(column, row): indices of the coords in that tile}
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if len(coords) == 0:
+        return {}
+    cells = np.floor((coords - origin) / tile_size).astype(np.int64)
+    tiles, inverse = np.unique(cells, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.searchsorted(inverse[order], np.arange(len(tiles) + 1))
+    return {(int(column), int(row)): order[bounds[i]:bounds[i + 1]]
+            for i, (column, row) in enumerate(tiles)}
+
+
+def halo_indices(buckets, coords, tile, origin, tile_size, halo):
+    # Indices of the coords within halo metres of a tile. The halo is never
+    # larger than a tile, so only the 3x3 surrounding tiles are looked at.
+    column, row = tile
+    candidates = [buckets[(column + dx, row + dy)] for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                  if (column + dx, row + dy) in buckets]
+    if not candidates:
+        return np.zeros(0, dtype=np.int64)
+    candidates = np.concatenate(candidates)
+    low = origin + np.array([column, row]) * tile_size - halo
+    high = low + tile_size + 2 * halo
+    inside = np.all((coords[candidates] >= low) & (coords[candidates] < high), axis=1)
+    return np.sort(candidates[inside])
+
+
+def in_qgis_desktop():
+    # Inside the QGIS desktop sys.executable is QGIS itself, which cannot be
+    # started as a pool worker
+    try:
+        from qgis.core import QgsApplication
+    except ImportError:
+        return False
+    return QgsApplication.instance() is not None and QgsApplication.platform() == 'desktop'
+
+
+def run_tiles(worker, tasks, max_workers=None):
+    # Results come back in task order whatever the worker finishing order, so the
+    # merge is deterministic. max_workers=0, and any run in the QGIS desktop,
+    # runs the tiles in this process.
+    if max_workers == 0 or len(tasks) < 2 or in_qgis_desktop():
+        return list(map(worker, tasks))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(worker, tasks))
+
+
+def _count_tile(task):
+    points, structures, radii = task
+    return count_within_radii(points, structures, radii)
+
+
+def tiled_count_within_radii(points, structures, radii, tile_size=5000, max_workers=None):
+    # count_within_radii split into tiles of tile_size metres. Every tile counts
+    # its own points against the structures within the largest radius of it.
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    structures = np.asarray(structures, dtype=float).reshape(-1, 2)
+    radii = np.atleast_1d(np.asarray(radii, dtype=float))
+    counts = np.zeros((len(radii), len(points)), dtype=np.int64)
+    if len(points) == 0 or len(structures) == 0:
+        return counts
+
+    halo = radii.max()
+    tile_size = max(tile_size, halo)
+    origin = np.minimum(points.min(axis=0), structures.min(axis=0))
+    point_buckets = tile_buckets(points, origin, tile_size)
+    structure_buckets = tile_buckets(structures, origin, tile_size)
+
+    tiles = sorted(point_buckets)
+    with stage('tile', len(tiles)):
+        tasks = [(points[point_buckets[tile]],
+                  structures[halo_indices(structure_buckets, structures, tile, origin, tile_size, halo)],
+                  radii)
+                 for tile in tiles]
+    with stage('count_tiles', len(points)):
+        results = run_tiles(_count_tile, tasks, max_workers)
+    for tile, tile_counts in zip(tiles, results):
+        counts[:, point_buckets[tile]] = tile_counts
+    return counts
+
+
+def _service_area_tile(task):
+    from service_areas import service_area_geometries
+
+    owned_count, points, radius, segments = task
+    geometries = service_area_geometries(points, radius, segments)
+    # QgsGeometry does not pickle, WKB does
+    return [bytes(geometry.asWkb()) for geometry in geometries[:owned_count]]
+
+
+def tiled_service_area_geometries(points, radius, segments=8, tile_size=5000, max_workers=None):
+    # service_area_geometries split into tiles. A cell clipped to radius R only
+    # depends on the poles within 2R, so each tile adds a 2R halo of neighbours
+    # to its own poles and keeps the cells of its own poles only.
+    from qgis.core import QgsGeometry
+
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(points) == 0:
+        return []
+    halo = 2 * radius
+    tile_size = max(tile_size, halo)
+    origin = points.min(axis=0)
+    buckets = tile_buckets(points, origin, tile_size)
+
+    tiles = sorted(buckets)
+    tasks = []
+    with stage('tile', len(tiles)):
+        for tile in tiles:
+            owned = buckets[tile]
+            neighbours = np.setdiff1d(
+                halo_indices(buckets, points, tile, origin, tile_size, halo), owned)
+            tasks.append((len(owned), points[np.concatenate([owned, neighbours])], radius, segments))
+    with stage('voronoi_tiles', len(points)):
+        results = run_tiles(_service_area_tile, tasks, max_workers)
+
+    geometries = [None] * len(points)
+    for tile, wkbs in zip(tiles, results):
+        for index, wkb in zip(buckets[tile], wkbs):
+            geometry = QgsGeometry()
+            geometry.fromWkb(wkb)
+            geometries[index] = geometry
+    return geometries
@@ -0,0 +1,143 @@
+import numpy as np
+from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform,
+                       QgsDistanceArea, QgsPointXY, QgsProject)
+
+import instrumentation
+from geometry_core import projection
+from geometry_core.geodesic import geodesic_lengths
+
+
+def as_coords(points):
+    # Accept a list of QgsPointXY or anything shaped (n, 2) and return an (n, 2) float array
+    if len(points) and hasattr(points[0], 'x') and callable(points[0].x):
+        return np.array([(point.x(), point.y()) for point in points], dtype=float).reshape(-1, 2)
+    return np.asarray(points, dtype=float).reshape(-1, 2)
+
+
+def crs_key(crs):
+    return crs.authid() or crs.toWkt()
+
+
+def epsg_code(crs):
+    # 4326 for EPSG:4326, None for CRSs without an EPSG code
+    authid = crs.authid()
+    if authid.upper().startswith('EPSG:') and authid[5:].isdigit():
+        return int(authid[5:])
+    return None
+
+
+class TransformService:
+    # Memoizes CRS objects, coordinate transforms (per source CRS and UTM zone/hemisphere)
+    # and QgsDistanceArea instances, so a run pays the setup cost once per zone.
+
+    def __init__(self, project=None):
+        self.project = project or QgsProject.instance()
+        self._crs = {}
+        self._transforms = {}
+        self._distance_areas = {}
+
+    def crs(self, epsg: int):
+        if epsg not in self._crs:
+            self._crs[epsg] = QgsCoordinateReferenceSystem(f'EPSG:{epsg}')
+        return self._crs[epsg]
+
+    def transform(self, source_crs, destination_crs):
+        key = (crs_key(source_crs), crs_key(destination_crs))
+        if key not in self._transforms:
+            instrumentation.count('QgsCoordinateTransform')
+            self._transforms[key] = QgsCoordinateTransform(
+                source_crs, destination_crs, self.project)
+        return self._transforms[key]
+
+    def to_utm_transform(self, source_crs, epsg: int):
+        return self.transform(source_crs, self.crs(epsg))
+
+    def from_utm_transform(self, epsg: int, destination_crs):
+        return self.transform(self.crs(epsg), destination_crs)
+
+    def distance_area(self, source_crs):
+        key = crs_key(source_crs)
+        if key not in self._distance_areas:
+            distance_area = QgsDistanceArea()
+            distance_area.setEllipsoid('WGS84')
+            distance_area.setSourceCrs(
+                source_crs, self.project.transformContext())
+            self._distance_areas[key] = distance_area
+        return self._distance_areas[key]
+
+    def _apply(self, transform, coords):
+        instrumentation.count('transform', len(coords))
+        # EPSG to EPSG transforms go through pyproj in one array call when available
+        source_epsg = epsg_code(transform.sourceCrs())
+        destination_epsg = epsg_code(transform.destinationCrs())
+        if source_epsg and destination_epsg:
+            try:
+                return projection.transform_coords(coords, source_epsg, destination_epsg)
+            except ImportError:
+                pass
+        result = np.empty_like(coords)
+        for i, (x, y) in enumerate(coords):
+            point = transform.transform(QgsPointXY(x, y))
+            result[i] = point.x(), point.y()
+        return result
+
+    def geographic(self, points, source_crs):
+        coords = as_coords(points)
+        if source_crs.isGeographic():
+            return coords
+        return self._apply(self.transform(source_crs, self.crs(4326)), coords)
+
+    def utm_epsg_codes(self, points, source_crs):
+        # UTM EPSG code for every point, derived from its longitude/latitude
+        return projection.utm_epsg_codes(self.geographic(points, source_crs))
+
+    def to_utm(self, points, source_crs, epsg_codes):
+        # Batch transform into UTM; epsg_codes is a single code or one code per point
+        coords = as_coords(points)
+        codes = np.broadcast_to(np.asarray(epsg_codes), (len(coords),))
+        result = np.empty_like(coords)
+        for epsg in np.unique(codes):
+            mask = codes == epsg
+            result[mask] = self._apply(
+                self.to_utm_transform(source_crs, int(epsg)), coords[mask])
+        return result
+
+    def from_utm(self, coords, epsg_codes, destination_crs):
+        coords = as_coords(coords)
+        codes = np.broadcast_to(np.asarray(epsg_codes), (len(coords),))
+        result = np.empty_like(coords)
+        for epsg in np.unique(codes):
+            mask = codes == epsg
+            result[mask] = self._apply(
+                self.from_utm_transform(int(epsg), destination_crs), coords[mask])
+        return result
+
+    def distances(self, points_a, points_b, source_crs):
+        # Ellipsoidal (WGS84) distance in metres between each pair of points
+        coords_a = as_coords(points_a)
+        coords_b = as_coords(points_b)
+        # EPSG CRSs measure all pairs in one pyproj geodesic call
+        if epsg_code(source_crs):
+            try:
+                return geodesic_lengths(self.geographic(coords_a, source_crs),
+                                        self.geographic(coords_b, source_crs))
+            except ImportError:
+                pass
+        distance_area = self.distance_area(source_crs)
+        instrumentation.count('measureLine', len(coords_a))
+        result = np.empty(len(coords_a))
+        for i, ((x1, y1), (x2, y2)) in enumerate(zip(coords_a, coords_b)):
+            result[i] = distance_area.measureLine(
+                QgsPointXY(x1, y1), QgsPointXY(x2, y2))
+        return result
+
+
+_shared_service = None
+
+
+def shared_transform_service():
+    # One service per QGIS session so every script reuses the same transforms
+    global _shared_service
+    if _shared_service is None or _shared_service.project is not QgsProject.instance():
+        _shared_service = TransformService()
+    return _shared_service
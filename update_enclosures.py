@@ -0,0 +1,28 @@
+from qgis.core import QgsProject
+import os
+
+from enclosures import save_enclosure_json, write_enclosures
+from instrumentation import run_report
+
+poles_layer_name = 'lv_poles'
+connection_layer_name = 'connection_distance'
+# None skips the enclosure.json list, a file name writes it next to the project
+output_json = 'enclosure.json'
+# Path of the JSON run report, None only logs the stage summaries
+report_path = None
+
+poles_layer = QgsProject.instance().mapLayersByName(poles_layer_name)[0]
+connection_layer = QgsProject.instance().mapLayersByName(connection_layer_name)[0]
+
+with run_report('enclosures', report_path):
+    # Sums connections per HubName once instead of one aggregate() per pole and
+    # stores total_connections and the enclosure text as real fields
+    rows = write_enclosures(poles_layer, connection_layer)
+    if output_json:
+        output_path = os.path.join(
+            QgsProject.instance().homePath(), output_json)
+        save_enclosure_json(rows, output_path)
+        print(f'Wrote {output_path}')
+
+poles_layer.triggerRepaint()
+print(f'Updated enclosures on {len(rows)} poles of {poles_layer_name}')
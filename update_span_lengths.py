@@ -0,0 +1,25 @@
+from qgis.core import QgsProject
+
+from instrumentation import run_report
+from span_lengths import update_span_lengths
+
+line_layer_name = 'lv_lines'
+# Poles whose back_span is filled from the span ending at them, None to skip
+pole_layer_name = 'lv_poles'
+# Feature ids of the edited lines to refresh only those spans, None for all
+edited_fids = None
+# Path of the JSON run report, None only logs the stage summaries
+report_path = None
+
+line_layer = QgsProject.instance().mapLayersByName(line_layer_name)[0]
+pole_layer = QgsProject.instance().mapLayersByName(pole_layer_name)[0] if pole_layer_name else None
+
+with run_report('span_lengths', report_path):
+    # WGS84 geodesic length of every span computed in one array pass, written to
+    # back_span/span_length on the lines and back_span on the end poles
+    lengths = update_span_lengths(line_layer, pole_layer, fids=edited_fids)
+
+line_layer.triggerRepaint()
+if pole_layer is not None:
+    pole_layer.triggerRepaint()
+print(f'Updated {len(lengths)} span lengths on {line_layer_name}')